@@ -4,6 +4,7 @@ from typing import List, Optional
 
 from pydantic import BaseModel, Field, model_validator
 
+from app.config import config
 from app.llm import LLM
 from app.logger import logger
 from app.schema import ROLE_TYPE, AgentState, Memory, Message
@@ -50,6 +51,9 @@ class BaseAgent(BaseModel, ABC):
         """Initialize agent with default settings if not provided."""
         if self.llm is None or not isinstance(self.llm, LLM):
             self.llm = LLM(config_name=self.name.lower())
+        elif "llm" not in self.model_fields_set and self.name.lower() in config.roles:
+            # Agents are mapped in [roles] by their lowercase name, e.g. lerobot = "fast"
+            self.llm = LLM.for_role(self.name.lower())
         if not isinstance(self.memory, Memory):
             self.memory = Memory()
         return self
@@ -4,13 +4,16 @@ from typing import Any, List, Optional, Union
 from pydantic import Field
 
 from app.agent.react import ReActAgent
+from app.compaction import ContextCompactor
 from app.exceptions import TokenLimitExceeded
+from app.llm import LLM
 from app.logger import logger
 from app.prompt.toolcall import NEXT_STEP_PROMPT, SYSTEM_PROMPT
 from app.schema import TOOL_CHOICE_TYPE, AgentState, Message, ToolCall, ToolChoice
 from app.tool import  ToolCollection
 from app.tool.color import Color
 from app.tool.robot_action import RobotAction
+from app.usage import usage_context
 TOOL_CALL_REQUIRED = "Tool calls required but none provided"
 
 
@@ -32,32 +35,67 @@ class ToolCallAgent(ReActAgent):
     max_steps: int = 30
     max_observe: Optional[Union[int, bool]] = None
 
+    compactor: Optional[ContextCompactor] = None
+
+    def get_compactor(self) -> Optional[ContextCompactor]:
+        """Compactor fitting the history to the LLM's token budget (None if disabled)"""
+        if self.compactor is None and self.llm.compaction:
+            summarizer = (
+                LLM.for_role("compaction")
+                if self.llm.compaction_summarize_at
+                else None
+            )
+            self.compactor = ContextCompactor(
+                self.llm,
+                summarizer=summarizer,
+                keep_recent=self.llm.compaction_keep_recent,
+                summarize_at=self.llm.compaction_summarize_at,
+            )
+        return self.compactor
+
     async def think(self) -> bool:
         """Process current state and decide next actions using tools"""
         if self.next_step_prompt:
             user_msg = Message.user_message(self.next_step_prompt)
             self.messages += [user_msg]
 
+        system_msgs = (
+            [Message.system_message(self.system_prompt)] if self.system_prompt else None
+        )
+        tools = self.available_tools.to_params()
         try:
+            # Older camera frames are resent at low detail or as a placeholder
+            image_report = self.memory.evict_images()
+            if image_report.images_evicted:
+                logger.info(
+                    f"🖼️ {self.name} sends {image_report.images_evicted} older images reduced "
+                    f"({image_report.newly_evicted} new): saves {image_report.tokens_saved} tokens, "
+                    f"{image_report.bytes_saved // 1024} KB on this request"
+                )
+
+            # Shrink old turns instead of stopping when the token budget runs out
+            compactor = self.get_compactor()
+            if compactor is not None:
+                await compactor.fit(self.memory, system_msgs=system_msgs, tools=tools)
+
             # Get response with tool options
-            response = await self.llm.ask_tool(
-                messages=self.messages,
-                system_msgs=[Message.system_message(self.system_prompt)]
-                if self.system_prompt
-                else None,
-                tools=self.available_tools.to_params(),
-                tool_choice=self.tool_choices,
-            )
+            with usage_context(caller=f"agent:{self.name}"):
+                response = await self.llm.ask_tool(
+                    messages=self.messages,
+                    system_msgs=system_msgs,
+                    tools=tools,
+                    tool_choice=self.tool_choices,
+                )
             
         except ValueError:
             raise
         except Exception as e:
-            # Check if this is a RetryError containing TokenLimitExceeded
-            if hasattr(e, "__cause__") and isinstance(e.__cause__, TokenLimitExceeded):
-                token_limit_error = e.__cause__
-                logger.error(
-                    f"🚨 Token limit error (from RetryError): {token_limit_error}"
-                )
+            # TokenLimitExceeded may be raised directly or wrapped in a RetryError
+            token_limit_error = (
+                e if isinstance(e, TokenLimitExceeded) else getattr(e, "__cause__", None)
+            )
+            if isinstance(token_limit_error, TokenLimitExceeded):
+                logger.error(f"🚨 Token limit error: {token_limit_error}")
                 self.memory.add_message(
                     Message.assistant_message(
                         f"Maximum token limit reached, cannot continue execution: {str(token_limit_error)}"
@@ -0,0 +1,74 @@
+import math
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class BatchItemResult(BaseModel):
+    """Outcome of one request in a batch"""
+
+    index: int = Field(..., description="Position of the request in the batch")
+    response: Any = Field(None, description="The LLM response, None on failure")
+    error: Optional[str] = Field(
+        None, description="Error message if the request failed"
+    )
+    timed_out: bool = Field(
+        False, description="True if the per-request timeout expired"
+    )
+    latency: float = Field(0.0, description="Seconds from start to completion")
+    prompt_tokens: int = Field(
+        0, description="Prompt tokens of the request's LLM calls"
+    )
+    completion_tokens: int = Field(
+        0, description="Completion tokens of the request's LLM calls"
+    )
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class BatchResult(BaseModel):
+    """Ordered per-request results and aggregate statistics of a batch"""
+
+    items: List[BatchItemResult] = Field(default_factory=list)
+    stats: Dict[str, Any] = Field(default_factory=dict)
+
+    @property
+    def responses(self) -> List[Any]:
+        """Responses in request order (None for failed requests)"""
+        return [item.response for item in self.items]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of `values` (0 for an empty list)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100.0 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize_batch(items: List[BatchItemResult], wall_time: float) -> Dict[str, Any]:
+    """
+    Aggregate latency, error and token statistics of a finished batch.
+
+    Latencies cover every request, failed and timed out ones included; tokens are
+    those of the batch's own calls.
+    """
+    latencies = [item.latency for item in items]
+    succeeded = sum(1 for item in items if item.ok)
+    return {
+        "requests": len(items),
+        "succeeded": succeeded,
+        "failed": len(items) - succeeded,
+        "timed_out": sum(1 for item in items if item.timed_out),
+        "wall_time": round(wall_time, 3),
+        "throughput": round(len(items) / wall_time, 3) if wall_time > 0 else 0.0,
+        "latency_mean": round(sum(latencies) / len(latencies), 3) if items else 0.0,
+        "latency_p50": round(percentile(latencies, 50), 3),
+        "latency_p95": round(percentile(latencies, 95), 3),
+        "latency_max": round(max(latencies), 3) if latencies else 0.0,
+        "prompt_tokens": sum(item.prompt_tokens for item in items),
+        "completion_tokens": sum(item.completion_tokens for item in items),
+    }
@@ -0,0 +1,212 @@
+import base64
+import binascii
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import config
+from app.image_utils import probe_image_size
+from app.logger import logger
+
+
+BLOB_URL_PREFIX = "blob:sha256:"
+
+
+def is_blob_url(url: Any) -> bool:
+    return isinstance(url, str) and url.startswith(BLOB_URL_PREFIX)
+
+
+class Blob:
+    """An image stored once per process, with its data URL encoded once"""
+
+    __slots__ = ("digest", "mime_type", "size", "nbytes", "data_url")
+
+    def __init__(
+        self,
+        digest: str,
+        mime_type: str,
+        size: Optional[Tuple[int, int]],
+        data_url: str,
+    ):
+        self.digest = digest
+        self.mime_type = mime_type
+        self.size = size  # (width, height), if known
+        self.nbytes = len(data_url)
+        self.data_url = data_url
+
+    @property
+    def url(self) -> str:
+        return BLOB_URL_PREFIX + self.digest
+
+    @property
+    def data(self) -> bytes:
+        return base64.b64decode(self.data_url.partition(",")[2])
+
+
+class BlobStore:
+    """
+    Process-wide, content-addressed store of image payloads.
+
+    Messages carry a short `blob:sha256:<digest>` URL instead of a base64 data URL,
+    so copies of the history, `to_dict` and log lines stay small. The data URL of
+    each image is encoded once and shared by every request sending it. The least
+    recently sent images are evicted beyond `max_bytes`, except images pinned by
+    the messages of an agent's memory (see `MessageBuffer`).
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self._blobs: "OrderedDict[str, Blob]" = OrderedDict()
+        # Number of live messages referencing each blob, by digest
+        self._pins: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.puts = 0
+        self.deduplicated = 0
+        self.evictions = 0
+        self.misses = 0
+
+    def put(
+        self, data: bytes, mime_type: str, size: Optional[Tuple[int, int]] = None
+    ) -> str:
+        """Store image bytes and return their blob URL"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self.puts += 1
+            blob = self._blobs.get(digest)
+            if blob is not None:
+                self.deduplicated += 1
+                self._blobs.move_to_end(digest)
+                return blob.url
+
+        data_url = f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+        blob = Blob(digest, mime_type, size or probe_image_size(data), data_url)
+        with self._lock:
+            if digest not in self._blobs:
+                self._blobs[digest] = blob
+                self.total_bytes += blob.nbytes
+                self._evict()
+        return blob.url
+
+    def put_data_url(self, url: str) -> str:
+        """Store the image of a base64 data URL; other URLs are returned unchanged"""
+        header, _, payload = url.partition(",")
+        if not header.startswith("data:") or not header.endswith(";base64"):
+            return url
+        try:
+            data = base64.b64decode(payload, validate=True)
+        except (binascii.Error, ValueError):
+            return url
+        return self.put(data, header[len("data:") : -len(";base64")])
+
+    def get(self, url: str) -> Optional[Blob]:
+        """The blob behind a blob URL (None if unknown or evicted)"""
+        digest = url[len(BLOB_URL_PREFIX) :] if is_blob_url(url) else url
+        with self._lock:
+            blob = self._blobs.get(digest)
+            if blob is None:
+                self.misses += 1
+            else:
+                self._blobs.move_to_end(digest)
+            return blob
+
+    def pin(self, urls: Tuple[str, ...]) -> Tuple[str, ...]:
+        """Keep the blobs behind `urls` from eviction until they are unpinned"""
+        if not urls:
+            return urls
+        with self._lock:
+            for url in urls:
+                digest = url[len(BLOB_URL_PREFIX) :]
+                self._pins[digest] = self._pins.get(digest, 0) + 1
+        return urls
+
+    def unpin(self, urls: Tuple[str, ...]) -> None:
+        """Release pins taken by `pin`; released blobs may be evicted again"""
+        if not urls:
+            return
+        with self._lock:
+            for url in urls:
+                digest = url[len(BLOB_URL_PREFIX) :]
+                count = self._pins.get(digest, 0) - 1
+                if count > 0:
+                    self._pins[digest] = count
+                else:
+                    self._pins.pop(digest, None)
+            self._evict()
+
+    def _evict(self) -> None:
+        if self.max_bytes is None or self.total_bytes <= self.max_bytes:
+            return
+        # Least recently used first; pinned blobs and the newest blob always stay
+        for digest in list(self._blobs)[:-1]:
+            if self.total_bytes <= self.max_bytes:
+                break
+            if digest in self._pins:
+                continue
+            blob = self._blobs.pop(digest)
+            self.total_bytes -= blob.nbytes
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._blobs.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "blobs": len(self._blobs),
+            "pinned": len(self._pins),
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "puts": self.puts,
+            "deduplicated": self.deduplicated,
+            "evictions": self.evictions,
+            "misses": self.misses,
+        }
+
+
+blob_store = BlobStore(max_bytes=config.image.blob_store_max_bytes)
+
+
+def materialize_messages(messages: List[dict]) -> List[dict]:
+    """
+    Replace blob URLs in formatted messages with their data URLs, for sending.
+
+    Only messages holding blob URLs are copied; the others are passed through.
+    Images no longer in the store are replaced by a text note.
+    """
+    materialized = []
+    for message in messages:
+        content = message.get("content")
+        if not isinstance(content, list) or not any(
+            isinstance(item, dict)
+            and item.get("type") == "image_url"
+            and is_blob_url(item.get("image_url", {}).get("url"))
+            for item in content
+        ):
+            materialized.append(message)
+            continue
+
+        new_content = []
+        for item in content:
+            url = (
+                item.get("image_url", {}).get("url") if isinstance(item, dict) else None
+            )
+            if not is_blob_url(url):
+                new_content.append(item)
+                continue
+            blob = blob_store.get(url)
+            if blob is None:
+                logger.warning(
+                    f"Image {url} is no longer in the blob store, sending a note instead"
+                )
+                new_content.append(
+                    {"type": "text", "text": "[image no longer available]"}
+                )
+                continue
+            new_content.append(
+                {**item, "image_url": {**item["image_url"], "url": blob.data_url}}
+            )
+        materialized.append({**message, "content": new_content})
+    return materialized
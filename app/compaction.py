@@ -0,0 +1,334 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from pydantic import BaseModel, Field
+
+from app.exceptions import TokenLimitExceeded
+from app.logger import logger
+from app.schema import Memory, Message, Role
+from app.usage import usage_context
+
+
+SUMMARY_PREFIX = "Summary of earlier conversation:\n"
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You compress the history of a robot agent's session. Summarize the conversation "
+    "below in a few short paragraphs: the task, what was tried, which robot actions "
+    "succeeded or failed, the current state of the scene and what remains to be done. "
+    "Keep object names, positions and error messages exact."
+)
+
+# Characters of each message shown to the summarizer
+_SUMMARY_MESSAGE_CHARS = 2000
+
+
+class CompactionRecord(BaseModel):
+    """Tokens saved by one compaction of an agent's history"""
+
+    timestamp: float = Field(default_factory=time.time)
+    budget: int = Field(..., description="Token budget the history had to fit")
+    tokens_before: int
+    tokens_after: int
+    tool_outputs_dropped: int = 0
+    images_stripped: int = 0
+    messages_summarized: int = 0
+    messages_dropped: int = 0
+    saved_by_stage: Dict[str, int] = Field(default_factory=dict)
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+class ContextCompactor:
+    """
+    Fits an agent's message history under the LLM's input token budget.
+
+    Messages older than the `keep_recent` most recent ones are compacted in stages,
+    cheapest first, until the history fits:
+
+    1. tool outputs are replaced by a short placeholder
+    2. images are replaced by a text marker
+    3. the old turns are replaced by a summary, produced by a background LLM call
+       started once the history reaches `summarize_at` of the budget
+    4. the oldest turns are dropped
+
+    The first message (the task request) is always kept, and a tool call is never
+    separated from its results. Token counts come from the per-message cache, so
+    only messages changed by a stage are tokenized again.
+
+    Args:
+        llm: LLM the history is sent to (counts tokens and defines the budget)
+        summarizer: LLM writing summaries (None disables summarization)
+        keep_recent: Number of most recent messages kept verbatim
+        summarize_at: Fraction of the budget at which a background summary starts
+    """
+
+    def __init__(
+        self,
+        llm: Any,
+        summarizer: Optional[Any] = None,
+        keep_recent: int = 6,
+        summarize_at: float = 0.75,
+    ):
+        self.llm = llm
+        self.summarizer = summarizer
+        self.keep_recent = keep_recent
+        self.summarize_at = summarize_at
+        self.records: List[CompactionRecord] = []
+
+        # Background summary of messages[1:end], valid while those messages are unchanged
+        self._summary_task: Optional[asyncio.Task] = None
+        self._summary_of: List[Message] = []
+
+    def _message_tokens(self, message: Message) -> int:
+        # count_message_tokens adds 2 tokens of request framing per call
+        return self.llm.count_message_tokens([message]) - 2
+
+    def _history_tokens(self, messages: List[Message]) -> int:
+        return self.llm.count_message_tokens(messages)
+
+    def _fixed_tokens(
+        self,
+        system_msgs: Optional[List[Union[dict, Message]]],
+        tools: Optional[List[dict]],
+    ) -> int:
+        """Tokens of the request that compaction cannot reduce"""
+        tokens = self.llm.count_message_tokens(system_msgs) if system_msgs else 0
+        for tool in tools or []:
+            tokens += self.llm.count_tool_tokens(tool)
+        return tokens
+
+    def _compactable_end(self, messages: List[Message]) -> int:
+        """Index of the first message kept verbatim (never inside a tool call's results)"""
+        # The latest message is always kept, even with keep_recent = 0
+        end = max(min(len(messages) - self.keep_recent, len(messages) - 1), 1)
+        while end > 1 and messages[end].role == Role.TOOL:
+            end -= 1
+        return end
+
+    def _drop_tool_outputs(
+        self, messages: List[Message], end: int, changed: List[Tuple[Message, Any]]
+    ) -> int:
+        dropped = 0
+        for message in messages[1:end]:
+            if message.role != Role.TOOL or not isinstance(message.content, str):
+                continue
+            if message.content.startswith("[tool output dropped"):
+                continue
+            tokens = self._message_tokens(message)
+            changed.append((message, message.content))
+            message.content = f"[tool output dropped to save context: {tokens} tokens]"
+            dropped += 1
+        return dropped
+
+    def _strip_images(
+        self, messages: List[Message], end: int, changed: List[Tuple[Message, Any]]
+    ) -> int:
+        stripped = 0
+        for message in messages[1:end]:
+            if not isinstance(message.content, list):
+                continue
+            content = []
+            for item in message.content:
+                if isinstance(item, dict) and item.get("type") == "image_url":
+                    content.append(
+                        {"type": "text", "text": "[image removed to save context]"}
+                    )
+                    stripped += 1
+                else:
+                    content.append(item)
+            if content != message.content:
+                changed.append((message, message.content))
+                message.content = content
+        return stripped
+
+    @staticmethod
+    def _render(message: Message) -> str:
+        """Plain-text form of a message for the summarizer"""
+        if isinstance(message.content, list):
+            parts = [
+                item.get("text", "") if item.get("type") == "text" else "[image]"
+                for item in message.content
+                if isinstance(item, dict)
+            ]
+            text = " ".join(parts)
+        else:
+            text = message.content or ""
+        if message.tool_calls:
+            calls = ", ".join(
+                f"{call.function.name}({call.function.arguments})"
+                for call in message.tool_calls
+            )
+            text = f"{text} [calls: {calls}]".strip()
+        if len(text) > _SUMMARY_MESSAGE_CHARS:
+            text = text[:_SUMMARY_MESSAGE_CHARS] + "..."
+        return f"{message.role}: {text}"
+
+    async def _summarize(self, transcript: str) -> str:
+        return await self.summarizer.ask(
+            [Message.user_message(transcript)],
+            system_msgs=[Message.system_message(SUMMARY_SYSTEM_PROMPT)],
+            stream=False,
+        )
+
+    def _summary_matches(self, messages: List[Message]) -> bool:
+        """Whether the pending summary covers a prefix (after the first) of `messages`"""
+        covered = len(self._summary_of)
+        return (
+            self._summary_task is not None
+            and covered > 0
+            and len(messages) > covered + 1
+            and all(a is b for a, b in zip(messages[1 : covered + 1], self._summary_of))
+            # Never leave tool results without the call that produced them
+            and messages[covered + 1].role != Role.TOOL
+        )
+
+    def _start_summary(self, messages: List[Message], end: int) -> None:
+        """Summarize messages[1:end] in the background"""
+        if self.summarizer is None or end <= 2 or self._summary_matches(messages):
+            return
+        if self._summary_task is not None:
+            # Summary of a history that has changed since
+            self._summary_task.cancel()
+        self._summary_of = list(messages[1:end])
+        # Rendered now: later compaction stages must not leak into the summary
+        transcript = "\n\n".join(self._render(m) for m in self._summary_of)
+        with usage_context(caller="compaction"):
+            self._summary_task = asyncio.ensure_future(self._summarize(transcript))
+        logger.info(f"Summarizing {end - 1} older messages in the background")
+
+    async def _take_summary(self, messages: List[Message]) -> Optional[str]:
+        """The summary of a prefix of `messages`, waiting for it if still running"""
+        if not self._summary_matches(messages):
+            return None
+        task = self._summary_task
+        if not task.done():
+            logger.info("Waiting for the background summary to fit the token budget")
+        try:
+            summary = await asyncio.shield(task)
+        except Exception as e:
+            logger.warning(f"Summarizing the history failed: {e}")
+            summary = None
+        self._summary_task = None
+        return summary or None
+
+    @staticmethod
+    def _is_summary(message: Message) -> bool:
+        return isinstance(message.content, str) and message.content.startswith(
+            SUMMARY_PREFIX
+        )
+
+    def _drop_oldest(
+        self, messages: List[Message], end: int
+    ) -> Tuple[List[Message], int]:
+        """Drop the oldest turn after the first message and the summary (tool results go with their call)"""
+        start = 2 if len(messages) > 1 and self._is_summary(messages[1]) else 1
+        if end <= start:
+            return messages, 0
+        cut = start + 1
+        while cut < end and messages[cut].role == Role.TOOL:
+            cut += 1
+        return messages[:start] + messages[cut:], cut - start
+
+    async def fit(
+        self,
+        memory: Memory,
+        system_msgs: Optional[List[Union[dict, Message]]] = None,
+        tools: Optional[List[dict]] = None,
+    ) -> Optional[CompactionRecord]:
+        """
+        Compact `memory` in place so the next request fits the token budget.
+
+        Returns:
+            The compaction record, or None if the history already fit
+
+        Raises:
+            TokenLimitExceeded: If the request cannot fit even with only the first
+                and the most recent messages left; `memory` is then left unchanged
+        """
+        budget = self.llm.input_token_budget()
+        if budget is None:
+            return None
+        budget -= self._fixed_tokens(system_msgs, tools)
+
+        messages = list(memory.messages)
+        tokens_before = self._history_tokens(messages)
+        end = self._compactable_end(messages)
+        if self.summarize_at and tokens_before >= budget * self.summarize_at:
+            self._start_summary(messages, end)
+        if tokens_before <= budget:
+            return None
+
+        record = CompactionRecord(
+            budget=budget, tokens_before=tokens_before, tokens_after=tokens_before
+        )
+        tokens = tokens_before
+        # Messages whose content a stage replaced, with their original content
+        changed: List[Tuple[Message, Any]] = []
+
+        def saved(stage: str, new_tokens: int) -> int:
+            record.saved_by_stage[stage] = tokens - new_tokens
+            return new_tokens
+
+        record.tool_outputs_dropped = self._drop_tool_outputs(messages, end, changed)
+        if record.tool_outputs_dropped:
+            tokens = saved("tool_outputs", self._history_tokens(messages))
+
+        if tokens > budget:
+            record.images_stripped = self._strip_images(messages, end, changed)
+            if record.images_stripped:
+                tokens = saved("images", self._history_tokens(messages))
+
+        if tokens > budget:
+            summary = await self._take_summary(messages)
+            if summary:
+                covered = len(self._summary_of)
+                messages = [
+                    messages[0],
+                    Message.user_message(SUMMARY_PREFIX + summary),
+                ] + messages[covered + 1 :]
+                record.messages_summarized = covered
+                tokens = saved("summary", self._history_tokens(messages))
+
+        if tokens > budget:
+            dropped_before = tokens
+            while tokens > budget:
+                messages, dropped = self._drop_oldest(
+                    messages, self._compactable_end(messages)
+                )
+                if not dropped:
+                    break
+                record.messages_dropped += dropped
+                tokens = self._history_tokens(messages)
+            record.saved_by_stage["dropped"] = dropped_before - tokens
+
+        if tokens > budget:
+            for message, content in reversed(changed):
+                message.content = content
+            raise TokenLimitExceeded(
+                f"History does not fit the input token budget after compaction "
+                f"(Needed: {tokens}, Budget: {budget})"
+            )
+
+        # Replaced in place, so the buffer keeps its limits and trimmed count
+        memory.messages[:] = messages
+        record.tokens_after = tokens
+        self.records.append(record)
+        logger.info(
+            f"Compacted history from {record.tokens_before} to {record.tokens_after} tokens "
+            f"(budget {budget}, saved {record.saved_by_stage})"
+        )
+        return record
+
+    def stats(self) -> Dict[str, Any]:
+        """Compactions so far and the tokens they saved"""
+        return {
+            "compactions": len(self.records),
+            "tokens_saved": sum(r.saved_tokens for r in self.records),
+            "tool_outputs_dropped": sum(r.tool_outputs_dropped for r in self.records),
+            "images_stripped": sum(r.images_stripped for r in self.records),
+            "messages_summarized": sum(r.messages_summarized for r in self.records),
+            "messages_dropped": sum(r.messages_dropped for r in self.records),
+        }
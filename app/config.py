@@ -26,6 +26,119 @@ class LLMSettings(BaseModel):
     temperature: float = Field(1.0, description="Sampling temperature")
     api_type: str = Field(..., description="AzureOpenai or Openai")
     api_version: str = Field(..., description="Azure Openai version if AzureOpenai")
+    max_retries: int = Field(
+        5, description="Retries of a failed API call on transient errors"
+    )
+    retry_max_wait: float = Field(
+        60, description="Upper bound in seconds for a single retry wait"
+    )
+    requests_per_minute: Optional[int] = Field(
+        None, description="Client-side request rate limit (None for unlimited)"
+    )
+    tokens_per_minute: Optional[int] = Field(
+        None, description="Client-side token rate limit (None for unlimited)"
+    )
+    max_concurrency: Optional[int] = Field(
+        None, description="Maximum concurrent requests (None for unlimited)"
+    )
+    response_cache: bool = Field(
+        False, description="Cache responses of deterministic (temperature 0) requests"
+    )
+    response_cache_path: Optional[str] = Field(
+        None, description="SQLite file for the response cache (None for workspace default)"
+    )
+    response_cache_ttl: int = Field(
+        86400, description="Seconds before a cached response expires"
+    )
+    response_cache_max_entries: int = Field(
+        1000, description="Maximum number of cached responses"
+    )
+    response_cache_max_bytes: int = Field(
+        64 * 1024 * 1024, description="Maximum total size of cached responses in bytes"
+    )
+    backend: str = Field(
+        "openai", description="openai (live API), record or replay (cassette file)"
+    )
+    cassette_path: Optional[str] = Field(
+        None, description="JSONL cassette for record/replay (None for workspace default)"
+    )
+    replay_latency_scale: float = Field(
+        0.0, description="Multiplier on recorded latencies when replaying (0 for instant)"
+    )
+    endpoints: Optional[List[str]] = Field(
+        None, description="Other [llm.*] configs serving the same model to route across"
+    )
+    failover_timeout: Optional[float] = Field(
+        None, description="Seconds before a slow endpoint is abandoned for the next one"
+    )
+    eject_after: int = Field(
+        3, description="Consecutive failures before an endpoint is temporarily skipped"
+    )
+    eject_seconds: float = Field(
+        30, description="Seconds an ejected endpoint is skipped"
+    )
+    probe_seconds: float = Field(
+        60,
+        description="Seconds after which an endpoint the router stopped choosing gets one request again",
+    )
+    coalesce_requests: bool = Field(
+        True,
+        description="Share one API call between identical ask_tool requests in flight",
+    )
+    hedge_percentile: Optional[float] = Field(
+        None,
+        description="Latency percentile after which hedged requests are duplicated (None disables hedging)",
+    )
+    hedge_min_samples: int = Field(
+        20, description="Latency samples of a call site needed before hedging starts there"
+    )
+    tokenizer_path: Optional[str] = Field(
+        None,
+        description="Local .tiktoken file, or directory of <encoding>.tiktoken files, for offline use",
+    )
+    token_counting: str = Field(
+        "exact",
+        description="Input token counting: exact (tokenizer) or estimate (calibrated length heuristic)",
+    )
+    compaction: bool = Field(
+        True, description="Compact agent history to fit the input token budget"
+    )
+    context_window: Optional[int] = Field(
+        None,
+        description="Input tokens per request that agent history is compacted to fit (None: no compaction)",
+    )
+    compaction_keep_recent: int = Field(
+        6, description="Most recent messages never compacted"
+    )
+    compaction_summarize_at: float = Field(
+        0.75,
+        description="Fraction of the budget at which older turns are summarized in the background (0 disables summaries)",
+    )
+
+
+class ImageSettings(BaseModel):
+    preprocess: bool = Field(
+        True, description="Resize and re-encode local images before upload"
+    )
+    max_tiles: int = Field(
+        4, description="Maximum 512px tiles per image at high detail"
+    )
+    jpeg_quality: int = Field(85, description="JPEG quality of re-encoded images")
+    roi: Optional[List[int]] = Field(
+        None, description="Region of interest to crop to, [left, top, right, bottom] in pixels"
+    )
+    blob_store_max_bytes: Optional[int] = Field(
+        256 * 1024 * 1024,
+        description="Encoded size of images kept in the blob store; least recently sent are evicted",
+    )
+    keep_last_images: Optional[int] = Field(
+        None,
+        description="Images kept at full detail in agent memory, newest first (None keeps all)",
+    )
+    evicted_images: str = Field(
+        "low",
+        description="What older images become: low (512px, low detail) or placeholder (text note)",
+    )
 
 
 # class ActionConfig(BaseModel):
@@ -126,8 +239,37 @@ class ActionConfig(BaseModel):
         ]
         return f"""     ## Available Actions (Total: {self.count}):\ncriteria\n{"\n".join(criteria)}\n\n{"\n\n".join(output)}"""
 
+class HttpSettings(BaseModel):
+    max_connections: int = Field(
+        100, description="Maximum open connections in the shared HTTP pool"
+    )
+    max_keepalive_connections: int = Field(
+        20, description="Idle connections kept open for reuse"
+    )
+    keepalive_expiry: float = Field(
+        60, description="Seconds an idle connection is kept open"
+    )
+    connect_timeout: float = Field(10, description="Seconds to establish a connection")
+    read_timeout: float = Field(600, description="Seconds to wait for response data")
+    write_timeout: float = Field(60, description="Seconds to send the request body")
+    pool_timeout: float = Field(
+        60, description="Seconds to wait for a free connection from the pool"
+    )
+    http2: bool = Field(False, description="Use HTTP/2 (requires the h2 package)")
+
+
 class AppConfig(BaseModel):
     llm: Dict[str, LLMSettings]
+    image: ImageSettings = Field(
+        default_factory=ImageSettings, description="Image upload settings"
+    )
+    http: HttpSettings = Field(
+        default_factory=HttpSettings, description="Shared HTTP connection pool settings"
+    )
+    roles: Dict[str, str] = Field(
+        default_factory=dict,
+        description="Component role (planner, plan_validator, ...) to [llm.*] config name",
+    )
     action: ActionConfig = Field(
         default_factory=ActionConfig,
         description="Action configurations"
@@ -205,8 +347,45 @@ class Config:
             "temperature": base_llm.get("temperature", 1.0),
             "api_type": base_llm.get("api_type", ""),
             "api_version": base_llm.get("api_version", ""),
+            "max_retries": base_llm.get("max_retries", 5),
+            "retry_max_wait": base_llm.get("retry_max_wait", 60),
+            "requests_per_minute": base_llm.get("requests_per_minute"),
+            "tokens_per_minute": base_llm.get("tokens_per_minute"),
+            "max_concurrency": base_llm.get("max_concurrency"),
+            "response_cache": base_llm.get("response_cache", False),
+            "response_cache_path": base_llm.get("response_cache_path"),
+            "response_cache_ttl": base_llm.get("response_cache_ttl", 86400),
+            "response_cache_max_entries": base_llm.get(
+                "response_cache_max_entries", 1000
+            ),
+            "response_cache_max_bytes": base_llm.get(
+                "response_cache_max_bytes", 64 * 1024 * 1024
+            ),
+            "backend": base_llm.get("backend", "openai"),
+            "cassette_path": base_llm.get("cassette_path"),
+            "replay_latency_scale": base_llm.get("replay_latency_scale", 0.0),
+            "endpoints": base_llm.get("endpoints"),
+            "failover_timeout": base_llm.get("failover_timeout"),
+            "eject_after": base_llm.get("eject_after", 3),
+            "eject_seconds": base_llm.get("eject_seconds", 30),
+            "probe_seconds": base_llm.get("probe_seconds", 60),
+            "coalesce_requests": base_llm.get("coalesce_requests", True),
+            "hedge_percentile": base_llm.get("hedge_percentile"),
+            "hedge_min_samples": base_llm.get("hedge_min_samples", 20),
+            "tokenizer_path": base_llm.get("tokenizer_path"),
+            "token_counting": base_llm.get("token_counting", "exact"),
+            "compaction": base_llm.get("compaction", True),
+            "context_window": base_llm.get("context_window"),
+            "compaction_keep_recent": base_llm.get("compaction_keep_recent", 6),
+            "compaction_summarize_at": base_llm.get("compaction_summarize_at", 0.75),
         }
 
+        roles = raw_config.get("roles", {})
+        known_configs = {"default", *llm_overrides}
+        unknown = {role: name for role, name in roles.items() if name not in known_configs}
+        if unknown:
+            raise ValueError(f"[roles] refers to undefined LLM configs: {unknown}")
+
         # 加载动作配置
         action_src_config = ActionConfig(actions=self._load_actions())
         action_config = ActionConfig.load_from_json(Path("config/action_base.json"))
@@ -219,6 +398,9 @@ class Config:
                     for name, override_config in llm_overrides.items()
                 },
             },
+            "image": raw_config.get("image", {}),
+            "roles": roles,
+            "http": raw_config.get("http", {}),
             "action": action_config,
             "action_src": action_src_config
         }
@@ -229,6 +411,22 @@ class Config:
     def llm(self) -> Dict[str, LLMSettings]:
         return self._config.llm
 
+    @property
+    def roles(self) -> Dict[str, str]:
+        return self._config.roles
+
+    def get_role_llm(self, role: str) -> str:
+        """Name of the LLM config serving a role ("default" if the role is not mapped)"""
+        return self._config.roles.get(role, "default")
+
+    @property
+    def http(self) -> HttpSettings:
+        return self._config.http
+
+    @property
+    def image(self) -> ImageSettings:
+        return self._config.image
+
     @property
     def action(self) -> ActionConfig:
         return self._config.action
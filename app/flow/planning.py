@@ -1,6 +1,7 @@
+import inspect
 import json
 import time
-from typing import Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Union
 
 from pydantic import Field
 
@@ -8,24 +9,41 @@ from app.agent.base import BaseAgent
 from app.flow.base import BaseFlow, PlanStepStatus
 from app.llm import LLM
 from app.logger import logger
+from app.retry_policy import RetryBudget
 from app.schema import AgentState, Message, ToolChoice
+from app.streaming import StreamEvent, ToolArgumentEvent, console_echo
 from app.tool import PlanningTool
 from app.tool.color import Color
 from app.tool.action_planning import ActionPlanningTool
 from app.tool.plan_validator import PlanValidator
+from app.usage import usage_context, usage_ledger
 import os
 
 
 class PlanningFlow(BaseFlow):
     """A flow that manages planning and execution of tasks using agents."""
 
-    llm: LLM = Field(default_factory=lambda: LLM())
+    llm: LLM = Field(default_factory=lambda: LLM.for_role("planner"))
     # planning_tool: PlanningTool = Field(default_factory=PlanningTool)
     planning_tool:  ActionPlanningTool = Field(default_factory=ActionPlanningTool)
     executor_keys: List[str] = Field(default_factory=list)
     active_plan_id: str = Field(default_factory=lambda: f"plan_{int(time.time())}")
     current_step_index: Optional[int] = None
     plan_validator: PlanValidator = Field(default_factory=PlanValidator)
+    on_plan_step: Optional[Callable[[int, Any], Any]] = Field(
+        default=None,
+        description=(
+            "Called with (index, action_id) as each plan step is streamed; steps "
+            "still execute only after the whole plan has been validated"
+        ),
+    )
+    summary_stream_handler: Optional[Callable[[StreamEvent], Any]] = Field(
+        default=console_echo,
+        description="Receives the streamed final summary (e.g. for a UI or TTS)",
+    )
+    llm_retry_budget: int = Field(
+        default=10, description="Retries of failed LLM calls allowed per flow run"
+    )
 
     def __init__(
         self, agents: Union[BaseAgent, List[BaseAgent], Dict[str, BaseAgent]], **data
@@ -70,6 +88,37 @@ class PlanningFlow(BaseFlow):
 
     async def execute(self, input_text: str) -> str:
         """Execute the planning flow with agents."""
+        # All LLM calls made during this run draw from one retry budget and are
+        # attributed to this plan in the usage ledger
+        with usage_context(flow_id=self.active_plan_id), RetryBudget(
+            self.llm_retry_budget
+        ).activate():
+            result = await self._execute(input_text)
+
+        self._log_usage()
+        return result
+
+    def _log_usage(self) -> None:
+        """Log the LLM usage of this run, broken down by caller."""
+        usage = usage_ledger.rollup(flow_id=self.active_plan_id)
+        total = usage["total"]
+        if not total["calls"]:
+            return
+        logger.info(
+            f"LLM usage for plan {self.active_plan_id}: {total['calls']} calls, "
+            f"{total['prompt_tokens']} prompt / {total['completion_tokens']} completion tokens, "
+            f"{total['prompt_cache_ratio']:.1%} of prompt tokens cached, "
+            f"{total['latency_total']:.1f}s in LLM calls"
+        )
+        for caller, stats in usage["by_caller"].items():
+            logger.info(
+                f"  {caller}: {stats['calls']} calls, {stats['prompt_tokens']} prompt / "
+                f"{stats['completion_tokens']} completion tokens, "
+                f"p50 {stats['latency_p50']:.2f}s, p95 {stats['latency_p95']:.2f}s"
+            )
+
+    async def _execute(self, input_text: str) -> str:
+        """Create the plan and run its steps until completion."""
         try:
             if not self.primary_agent:
                 raise ValueError("No primary agent available")
@@ -133,13 +182,25 @@ class PlanningFlow(BaseFlow):
                 f"Create a reasonable plan with clear steps to accomplish the task: {request}"
             )
 
-        # Call LLM with PlanningTool
-        response = await self.llm.ask_tool(
-            messages=[user_message],
-            system_msgs=[system_message],
-            tools=[self.planning_tool.to_param()],
-            tool_choice=ToolChoice.AUTO,
-        )
+        # Call LLM with PlanningTool, streaming the steps if someone listens for them
+        with usage_context(caller="planner"):
+            if self.on_plan_step is not None:
+                response = await self.llm.ask_tool_stream(
+                    messages=[user_message],
+                    system_msgs=[system_message],
+                    tools=[self.planning_tool.to_param()],
+                    tool_choice=ToolChoice.AUTO,
+                    on_argument=self._forward_plan_step,
+                )
+            else:
+                # The plan gates the whole run, so slow calls are hedged
+                response = await self.llm.ask_tool(
+                    messages=[user_message],
+                    system_msgs=[system_message],
+                    tools=[self.planning_tool.to_param()],
+                    tool_choice=ToolChoice.AUTO,
+                    hedge=True,
+                )
 
         # Process tool calls if present
         if response.tool_calls:
@@ -179,6 +240,23 @@ class PlanningFlow(BaseFlow):
             }
         )
 
+    async def _forward_plan_step(self, event: ToolArgumentEvent) -> None:
+        """
+        Pass each plan step to `on_plan_step` as soon as it has been generated.
+
+        This only lets the caller prepare the action (e.g. load a policy); the flow
+        itself does not run a step before the plan validator has accepted the plan.
+        """
+        if (
+            event.tool_name != self.planning_tool.name
+            or event.key != "steps"
+            or event.index is None
+        ):
+            return
+        result = self.on_plan_step(event.index, event.value)
+        if inspect.isawaitable(result):
+            await result
+
     async def _get_current_step_info(self) -> tuple[Optional[int], Optional[dict]]:
         """
         Parse the current plan to identify the first non-completed step's index and info.
@@ -388,9 +466,12 @@ class PlanningFlow(BaseFlow):
                 f"The plan has been completed. Here is the final plan status:\n\n{plan_text}\n\nPlease provide a summary of what was accomplished and any final thoughts."
             )
 
-            response = await self.llm.ask(
-                messages=[user_message], system_msgs=[system_message]
-            )
+            with usage_context(caller="finalize"):
+                response = await self.llm.ask(
+                    messages=[user_message],
+                    system_msgs=[system_message],
+                    stream_handler=self.summary_stream_handler,
+                )
 
             return f"Plan completed:\n\n{response}"
         except Exception as e:
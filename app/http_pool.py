@@ -0,0 +1,170 @@
+import asyncio
+import importlib.util
+import threading
+import urllib.request
+from typing import Any, Dict, Optional
+
+import httpx
+
+from app.config import HttpSettings, config
+from app.logger import logger
+
+
+class PooledTransport(httpx.AsyncBaseTransport):
+    """
+    Process-wide HTTP transport shared by the clients of every `LLM` instance.
+
+    Connections are pooled per event loop: httpx connections cannot outlive the loop
+    that opened them, so a new pool is created when requests arrive from a new loop
+    (e.g. a second `asyncio.run`). Proxies from the environment (HTTPS_PROXY,
+    NO_PROXY, ...) are honored as they would be by a default httpx client.
+    """
+
+    def __init__(self, settings: HttpSettings):
+        self.settings = settings
+        self.http2 = settings.http2
+        if self.http2 and importlib.util.find_spec("h2") is None:
+            logger.warning(
+                "HTTP/2 requested but the 'h2' package is not installed, using HTTP/1.1"
+            )
+            self.http2 = False
+        self.limits = httpx.Limits(
+            max_connections=settings.max_connections,
+            max_keepalive_connections=settings.max_keepalive_connections,
+            keepalive_expiry=settings.keepalive_expiry,
+        )
+        self._proxies = urllib.request.getproxies()
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pools: Dict[Optional[str], httpx.AsyncHTTPTransport] = {}
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.connections_opened = 0
+        self.pools_created = 0
+
+    def _pool_for(self, request: httpx.Request) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        host = request.url.host
+        proxy = None
+        if not urllib.request.proxy_bypass(host):
+            proxy = self._proxies.get(request.url.scheme) or self._proxies.get("all")
+
+        with self._lock:
+            if self._loop is not loop:
+                # Connections of a previous loop are unusable, start over
+                self._loop = loop
+                self._pools = {}
+            pool = self._pools.get(proxy)
+            if pool is None:
+                pool = httpx.AsyncHTTPTransport(
+                    limits=self.limits, http2=self.http2, proxy=proxy
+                )
+                self._pools[proxy] = pool
+                self.pools_created += 1
+            return pool
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        # Only requests that cannot reuse a pooled connection open a new one
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+
+        outer_trace = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            await self._trace(event_name, info)
+            if outer_trace is not None:
+                await outer_trace(event_name, info)
+
+        request.extensions["trace"] = trace
+        return await self._pool_for(request).handle_async_request(request)
+
+    async def aclose(self) -> None:
+        # Owned by the process, not by the clients using it: see close_http_pool()
+        pass
+
+    async def close_connections(self) -> None:
+        """Close every pooled connection"""
+        with self._lock:
+            pools = list(self._pools.values())
+            same_loop = self._loop is asyncio.get_running_loop()
+            self._pools = {}
+            self._loop = None
+        if not same_loop:
+            # The loop owning the connections is gone, and its sockets with it
+            return
+        for pool in pools:
+            await pool.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        """Request and connection reuse counters"""
+        open_connections = 0
+        for pool in list(self._pools.values()):
+            # httpcore keeps its connections on the pool; not part of the httpx API
+            connections = getattr(getattr(pool, "_pool", None), "connections", None)
+            open_connections += len(connections or [])
+        reused = max(self.requests - self.connections_opened, 0)
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "reused_requests": reused,
+            "reuse_ratio": round(reused / self.requests, 3) if self.requests else 0.0,
+            "open_connections": open_connections,
+            "pools_created": self.pools_created,
+            "http2": self.http2,
+            "max_connections": self.settings.max_connections,
+            "max_keepalive_connections": self.settings.max_keepalive_connections,
+        }
+
+
+_transport: Optional[PooledTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_http_transport() -> PooledTransport:
+    """The process-wide transport, created from the [http] settings on first use"""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = PooledTransport(config.http)
+        return _transport
+
+
+def get_timeout(settings: Optional[HttpSettings] = None) -> httpx.Timeout:
+    settings = settings or config.http
+    return httpx.Timeout(
+        connect=settings.connect_timeout,
+        read=settings.read_timeout,
+        write=settings.write_timeout,
+        pool=settings.pool_timeout,
+    )
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """An httpx client for one API client, backed by the shared connection pool"""
+    return httpx.AsyncClient(transport=get_http_transport(), timeout=get_timeout())
+
+
+def get_http_pool_stats() -> Dict[str, Any]:
+    """Connection reuse statistics of the shared pool"""
+    return _transport.stats() if _transport is not None else {"requests": 0}
+
+
+async def close_http_pool() -> None:
+    """
+    Close the shared pool's connections; call on shutdown.
+
+    The pool reopens connections if it is used again afterwards.
+    """
+    transport = _transport
+    if transport is None:
+        return
+    stats = transport.stats()
+    await transport.close_connections()
+    logger.info(
+        f"Closed HTTP pool: {stats['requests']} requests over "
+        f"{stats['connections_opened']} connections ({stats['reuse_ratio']:.0%} reused)"
+    )
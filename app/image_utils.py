@@ -0,0 +1,300 @@
+import base64
+import binascii
+import math
+import mimetypes
+import struct
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Optional, Sequence, Tuple, Union
+
+from PIL import Image
+from pydantic import BaseModel, Field
+
+from app.config import config
+from app.logger import logger
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SOI = b"\xff\xd8"
+
+# JPEG start-of-frame markers carrying the image dimensions (excludes DHT/JPG/DAC)
+_JPEG_SOF_MARKERS = {
+    0xC0,
+    0xC1,
+    0xC2,
+    0xC3,
+    0xC5,
+    0xC6,
+    0xC7,
+    0xC9,
+    0xCA,
+    0xCB,
+    0xCD,
+    0xCE,
+    0xCF,
+}
+# Markers without a length field
+_JPEG_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD9)}
+
+# Base64 characters decoded on the first probe attempt (covers PNG IHDR and most JPEG headers)
+DEFAULT_PROBE_CHARS = 512
+
+
+def _probe_png(data: bytes) -> Optional[Tuple[int, int]]:
+    """Read width and height from the PNG IHDR chunk"""
+    if len(data) < 24 or data[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", data[16:24])
+    return width, height
+
+
+def _probe_jpeg(data: bytes) -> Optional[Tuple[int, int]]:
+    """Walk JPEG segments up to the first SOF marker; None if the data ends first"""
+    offset = 2
+    size = len(data)
+    while offset + 4 <= size:
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before the actual marker
+            offset += 1
+            continue
+        if marker in _JPEG_STANDALONE_MARKERS:
+            offset += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            if offset + 9 > size:
+                return None
+            height, width = struct.unpack(">HH", data[offset + 5 : offset + 9])
+            return width, height
+        (segment_length,) = struct.unpack(">H", data[offset + 2 : offset + 4])
+        offset += 2 + segment_length
+    return None
+
+
+def probe_image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Read (width, height) from the header of PNG or JPEG bytes without decoding pixels.
+
+    Returns None if the format is not recognized or the header is incomplete.
+    """
+    if data.startswith(PNG_SIGNATURE):
+        return _probe_png(data)
+    if data.startswith(JPEG_SOI):
+        return _probe_jpeg(data)
+    return None
+
+
+def probe_data_url_size(
+    url: str, prefix_chars: int = DEFAULT_PROBE_CHARS
+) -> Optional[Tuple[int, int]]:
+    """
+    Read (width, height) from a base64 data URL by decoding only its leading characters.
+
+    JPEG headers can be pushed back by EXIF/ICC segments, so the decoded prefix grows
+    until the SOF marker is found or the whole payload has been read.
+
+    Returns None if the dimensions cannot be determined from the header.
+    """
+    header, _, payload = url.partition(",")
+    if not header.startswith("data:") or not header.endswith(";base64"):
+        return None
+
+    limit = prefix_chars
+    while True:
+        chunk = payload[:limit]
+        chunk = chunk[: len(chunk) - len(chunk) % 4]
+        try:
+            data = base64.b64decode(chunk, validate=True)
+        except (binascii.Error, ValueError):
+            return None
+
+        dimensions = probe_image_size(data)
+        if dimensions is not None:
+            return dimensions
+        if limit >= len(payload) or not data.startswith(JPEG_SOI):
+            return None
+        limit *= 4
+
+
+# Vision token pricing used by `LLM.count_tokens`
+TILE_SIZE = 512
+BASE_IMAGE_TOKENS = 85
+TILE_TOKENS = 170
+
+
+def count_tiles(width: int, height: int) -> int:
+    """Number of 512px tiles covering an image"""
+    return math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Token cost of an image: a base cost plus 170 tokens per tile above low detail"""
+    if detail == "low":
+        return BASE_IMAGE_TOKENS
+    return BASE_IMAGE_TOKENS + count_tiles(width, height) * TILE_TOKENS
+
+
+def fit_to_tile_budget(width: int, height: int, max_tiles: int) -> Tuple[int, int]:
+    """
+    Largest size with the same aspect ratio that fits in `max_tiles` tiles.
+
+    Images already within the budget are returned unchanged; images are never upscaled.
+    """
+    if max_tiles < 1 or count_tiles(width, height) <= max_tiles:
+        return width, height
+
+    # Try every tile grid within the budget and keep the one allowing the largest scale
+    best_scale = 0.0
+    for cols in range(1, max_tiles + 1):
+        rows = max_tiles // cols
+        scale = min(cols * TILE_SIZE / width, rows * TILE_SIZE / height, 1.0)
+        best_scale = max(best_scale, scale)
+    new_width = max(int(width * best_scale), 1)
+    new_height = max(int(height * best_scale), 1)
+    return new_width, new_height
+
+
+class PreparedImage(BaseModel):
+    """An image ready for upload, with its size and token cost before and after preprocessing"""
+
+    data: bytes = Field(..., description="Encoded image bytes")
+    mime_type: str = Field(..., description="MIME type of `data`")
+    original_size: Tuple[int, int] = Field(..., description="(width, height) as loaded")
+    size: Tuple[int, int] = Field(..., description="(width, height) as uploaded")
+    original_bytes: int = Field(..., description="Size of the source file in bytes")
+    original_tokens: int = Field(..., description="Token cost of the unprocessed image")
+    tokens: int = Field(..., description="Token cost of the prepared image")
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.tokens
+
+    @property
+    def base64(self) -> str:
+        return base64.b64encode(self.data).decode("utf-8")
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.base64}"
+
+    def describe(self) -> str:
+        """One-line summary of the savings, for logs"""
+        (w0, h0), (w1, h1) = self.original_size, self.size
+        return (
+            f"{w0}x{h0} -> {w1}x{h1}, {self.original_tokens} -> {self.tokens} tokens "
+            f"(saved {self.saved_tokens}), {self.original_bytes // 1024} KB -> "
+            f"{len(self.data) // 1024} KB"
+        )
+
+
+def prepare_image(
+    data: bytes,
+    mime_type: Optional[str] = None,
+    max_tiles: Optional[int] = 4,
+    jpeg_quality: int = 85,
+    roi: Optional[Sequence[int]] = None,
+    detail: str = "high",
+) -> PreparedImage:
+    """
+    Crop, resize and re-encode an image so it costs at most `max_tiles` tiles.
+
+    Args:
+        data: Raw PNG/JPEG (or any PIL-readable) image bytes
+        mime_type: MIME type of `data`, used if the original is kept
+        max_tiles: Tile budget at high detail (None to keep the resolution)
+        jpeg_quality: Quality of the JPEG re-encode
+        roi: Optional crop box (left, top, right, bottom) in source pixels
+        detail: Detail level the image will be sent with, for the token report
+
+    Returns:
+        The prepared image. The original bytes are kept if re-encoding would
+        neither shrink the image nor its token cost.
+    """
+    with Image.open(BytesIO(data)) as img:
+        original_size = img.size
+        mime_type = mime_type or Image.MIME.get(img.format, "image/png")
+        original_tokens = estimate_image_tokens(*original_size, detail)
+
+        if roi is not None:
+            left, top, right, bottom = roi
+            img = img.crop(
+                (
+                    max(left, 0),
+                    max(top, 0),
+                    min(right, original_size[0]),
+                    min(bottom, original_size[1]),
+                )
+            )
+        size = fit_to_tile_budget(*img.size, max_tiles) if max_tiles else img.size
+        if size != img.size:
+            img = img.resize(size, Image.LANCZOS)
+
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        buffer = BytesIO()
+        img.save(buffer, format="JPEG", quality=jpeg_quality, optimize=True)
+        encoded = buffer.getvalue()
+
+    if size == original_size and roi is None and len(encoded) >= len(data):
+        # Nothing to gain: keep the original file
+        return PreparedImage(
+            data=data,
+            mime_type=mime_type,
+            original_size=original_size,
+            size=original_size,
+            original_bytes=len(data),
+            original_tokens=original_tokens,
+            tokens=original_tokens,
+        )
+    return PreparedImage(
+        data=encoded,
+        mime_type="image/jpeg",
+        original_size=original_size,
+        size=size,
+        original_bytes=len(data),
+        original_tokens=original_tokens,
+        tokens=estimate_image_tokens(*size, detail),
+    )
+
+
+def prepare_image_file(
+    path: Union[str, Path],
+    detail: str = "high",
+    mime_type: Optional[str] = None,
+    **kwargs: Any,
+) -> PreparedImage:
+    """
+    Load an image file and prepare it for upload with the `[image]` settings.
+
+    Keyword arguments (max_tiles, jpeg_quality, roi) override the settings.
+    """
+    settings = config.image
+    options = {
+        "max_tiles": settings.max_tiles,
+        "jpeg_quality": settings.jpeg_quality,
+        "roi": settings.roi,
+        **{k: v for k, v in kwargs.items() if v is not None},
+    }
+    path = Path(path)
+    data = path.read_bytes()
+    if mime_type is None:
+        mime_type = mimetypes.guess_type(path.name)[0]
+    if not settings.preprocess:
+        with Image.open(BytesIO(data)) as img:
+            size = img.size
+        tokens = estimate_image_tokens(*size, detail)
+        return PreparedImage(
+            data=data,
+            mime_type=mime_type or "image/png",
+            original_size=size,
+            size=size,
+            original_bytes=len(data),
+            original_tokens=tokens,
+            tokens=tokens,
+        )
+
+    prepared = prepare_image(data, mime_type=mime_type, detail=detail, **options)
+    logger.info(f"Prepared image {path.name}: {prepared.describe()}")
+    return prepared
@@ -1,6 +1,16 @@
-from typing import Dict, List, Optional, Union, Any
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-import tiktoken
 from openai import (
     APIError,
     AsyncAzureOpenAI,
@@ -9,16 +19,19 @@ from openai import (
     OpenAIError,
     RateLimitError,
 )
-from tenacity import (
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_random_exponential,
-)
+from openai.types.chat import ChatCompletionMessage
 
-from app.config import LLMSettings, config
+from app.batch import BatchItemResult, BatchResult, percentile, summarize_batch
+from app.blob_store import blob_store, is_blob_url
+from app.config import WORKSPACE_ROOT, LLMSettings, config
 from app.exceptions import TokenLimitExceeded
+from app.http_pool import create_http_client, get_timeout
+from app.image_utils import estimate_image_tokens, probe_data_url_size
+from app.llm_backend import LLMBackend, OpenAIBackend, create_backend
+from app.llm_router import Endpoint, RouterBackend
 from app.logger import logger  # Assuming a logger is set up in your app
+from app.rate_limiter import RateLimiter
+from app.retry_policy import RetryPolicy
 from app.schema import (
     ROLE_VALUES,
     TOOL_CHOICE_TYPE,
@@ -26,19 +39,262 @@ from app.schema import (
     Message,
     ToolChoice,
 )
+from app.streaming import (
+    StreamEvent,
+    ToolArgumentEvent,
+    ToolCallStreamAccumulator,
+    console_echo,
+)
+from app.tokenizer import (
+    TOKEN_COUNTING_MODES,
+    LazyEncoding,
+    TokenCountErrors,
+    TokenEstimator,
+    encoding_name_for_model,
+)
+from app.usage import (
+    UsageRecord,
+    collect_usage,
+    get_current_caller,
+    get_current_flow,
+    usage_ledger,
+)
 
+import asyncio
 import base64
+import hashlib
+import inspect
+import json
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
 from io import BytesIO
 from PIL import Image
-import math
 import warnings
+from enum import Enum
 
 
 REASONING_MODELS = ["o1", "o3-mini"]
 from app.tool.color import Color,format_chat_completion
 
+
+class ImageTokenCache:
+    """Bounded LRU cache of image token costs, keyed by image content and detail level"""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(url: str, detail: str) -> str:
+        """Build a content-addressed key from the image URL and detail level"""
+        digest = hashlib.blake2b(url.encode("utf-8"), digest_size=16).hexdigest()
+        return f"{digest}:{detail}"
+
+    def get(self, key: str) -> Optional[int]:
+        """Return the cached token cost, or None on a miss"""
+        tokens = self._entries.get(key)
+        if tokens is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return tokens
+
+    def put(self, key: str, tokens: int) -> None:
+        """Store a token cost, evicting the least recently used entry when full"""
+        self._entries[key] = tokens
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop all entries and reset counters"""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and current size"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+        }
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of LLM responses for deterministic requests.
+
+    Entries expire after `ttl` seconds; the least recently used entries are evicted
+    once the cache holds more than `max_entries` responses or `max_bytes` of data.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        ttl: int = 86400,
+        max_entries: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Access times of cache hits, written on the next put so a hit never commits
+        self._pending_access: Dict[str, float] = {}
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(**request: Any) -> str:
+        """Build a cache key from the request fields (model, messages, tools, ...)"""
+        serialized = json.dumps(
+            _normalize_for_cache(request),
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value, or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl:
+                # Deleted by the next put
+                self.misses += 1
+                return None
+            self._pending_access[key] = now
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        """Store a value and evict expired or least recently used entries"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            self.stores += 1
+            self._pending_access.pop(key, None)
+            self._flush_access_times()
+            self._evict(now)
+            self._conn.commit()
+
+    def _flush_access_times(self) -> None:
+        """Write the access times of cache hits since the last put (for LRU eviction)"""
+        if self._pending_access:
+            self._conn.executemany(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._pending_access.items()],
+            )
+            self._pending_access.clear()
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then the oldest ones until the size limits hold"""
+        cursor = self._conn.execute(
+            "DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)
+        )
+        self.evictions += max(cursor.rowcount, 0)
+
+        count, total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        rows = self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at ASC"
+        ).fetchall()
+        for key, size in rows:
+            if count <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            count -= 1
+            total_bytes -= size
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all entries and reset counters"""
+        with self._lock:
+            self._pending_access.clear()
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self.hits = self.misses = self.stores = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss metrics and current size"""
+        with self._lock:
+            count, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "entries": count,
+            "bytes": total_bytes,
+        }
+
+
+def _normalize_for_cache(value: Any) -> Any:
+    """Normalize request data so equivalent requests produce the same cache key"""
+    if isinstance(value, dict):
+        return {
+            str(k): _normalize_for_cache(v) for k, v in value.items() if v is not None
+        }
+    if isinstance(value, (list, tuple)):
+        return [_normalize_for_cache(v) for v in value]
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def _prompt_cache_stats(input_tokens: int, cached_tokens: int) -> Dict[str, Any]:
+    return {
+        "input_tokens": input_tokens,
+        "cached_tokens": cached_tokens,
+        "cache_ratio": cached_tokens / input_tokens if input_tokens else 0.0,
+    }
+
+
 class LLM:
     _instances: Dict[str, "LLM"] = {}
+    # Shared by all instances: image token costs only depend on the image content
+    image_token_cache: ImageTokenCache = ImageTokenCache()
 
     def __new__(
         cls, config_name: str = "default", llm_config: Optional[LLMSettings] = None
@@ -49,12 +305,18 @@ class LLM:
             cls._instances[config_name] = instance
         return cls._instances[config_name]
 
+    @classmethod
+    def for_role(cls, role: str) -> "LLM":
+        """The LLM serving a component role, as mapped in the [roles] config section"""
+        return cls(config.get_role_llm(role))
+
     def __init__(
         self, config_name: str = "default", llm_config: Optional[LLMSettings] = None
     ):
         if not hasattr(self, "client"):  # Only initialize if not already initialized
             llm_config = llm_config or config.llm
             llm_config = llm_config.get(config_name, llm_config["default"])
+            self.config_name = config_name
             self.model = llm_config.model
             self.max_tokens = llm_config.max_tokens
             self.temperature = llm_config.temperature
@@ -65,27 +327,167 @@ class LLM:
 
             # Add token counting related attributes
             self.total_input_tokens = 0
+            self.total_cached_tokens = 0
             self.max_input_tokens = (
                 llm_config.max_input_tokens
                 if hasattr(llm_config, "max_input_tokens")
                 else None
             )
+            # Agent history is compacted to fit these budgets (see app.compaction)
+            self.context_window = llm_config.context_window
+            self.compaction = llm_config.compaction
+            self.compaction_keep_recent = llm_config.compaction_keep_recent
+            self.compaction_summarize_at = llm_config.compaction_summarize_at
+
+            # Identical ask_tool requests currently in flight, keyed by request hash
+            self.coalesce_requests = llm_config.coalesce_requests
+            self._inflight_requests: Dict[str, asyncio.Future] = {}
+            # Callers awaiting each in-flight request; it is cancelled when none are left
+            self._inflight_waiters: Dict[str, int] = {}
+            self.coalesced_requests = 0
+
+            # Recent API latencies per call site (method and usage caller); a hedged
+            # request is duplicated once it runs longer than hedge_percentile of
+            # the latencies of its own call site
+            self.hedge_percentile = llm_config.hedge_percentile
+            self.hedge_min_samples = llm_config.hedge_min_samples
+            self._latency_samples: Dict[str, Deque[float]] = {}
+            self.hedged_requests = 0
+            self.hedge_wins = 0
+
+            # Token cost of tool schemas, keyed by tool fingerprint
+            # -> (tool name, tokens, token count key)
+            self._tool_token_cache: Dict[str, Tuple[str, int, str]] = {}
+
+            # Tokenizer is loaded on first use and shared by every instance
+            self.tokenizer = LazyEncoding(
+                encoding_name_for_model(self.model), llm_config.tokenizer_path
+            )
+            self.set_token_counting(llm_config.token_counting)
 
-            # Initialize tokenizer
-            try:
-                self.tokenizer = tiktoken.encoding_for_model(self.model)
-            except KeyError:
-                # If the model is not in tiktoken's presets, use cl100k_base as default
-                self.tokenizer = tiktoken.get_encoding("cl100k_base")
-
-            if self.api_type == "azure":
-                self.client = AsyncAzureOpenAI(
-                    base_url=self.base_url,
-                    api_key=self.api_key,
-                    api_version=self.api_version,
+            # Only the API call itself is retried, and only on transient errors
+            self.retry_policy = RetryPolicy(
+                max_attempts=llm_config.max_retries + 1,
+                max_wait=llm_config.retry_max_wait,
+            )
+
+            # Client-side rate limits, shared by every request made with this config
+            self.rate_limiter = RateLimiter(
+                config_name,
+                requests_per_minute=llm_config.requests_per_minute,
+                tokens_per_minute=llm_config.tokens_per_minute,
+                max_concurrency=llm_config.max_concurrency,
+            )
+
+            # Opt-in cache for deterministic requests
+            self.response_cache: Optional[ResponseCache] = None
+            if llm_config.response_cache:
+                self.response_cache = ResponseCache(
+                    path=llm_config.response_cache_path
+                    or WORKSPACE_ROOT / "llm_response_cache.db",
+                    ttl=llm_config.response_cache_ttl,
+                    max_entries=llm_config.response_cache_max_entries,
+                    max_bytes=llm_config.response_cache_max_bytes,
                 )
-            else:
-                self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+
+            self.client = self._create_client(llm_config)
+
+            # Live API by default; record/replay cassettes for offline benchmarks
+            self.backend: LLMBackend = create_backend(
+                llm_config.backend,
+                self._create_live_backend(config_name, llm_config),
+                cassette_path=llm_config.cassette_path
+                or WORKSPACE_ROOT / "llm_cassette.jsonl",
+                latency_scale=llm_config.replay_latency_scale,
+            )
+
+    @staticmethod
+    def _create_client(llm_config: LLMSettings) -> Union[AsyncOpenAI, AsyncAzureOpenAI]:
+        # Retries are handled by retry_policy, so the SDK's own retries are disabled.
+        # All clients share one connection pool (see app.http_pool).
+        if llm_config.api_type == "azure":
+            return AsyncAzureOpenAI(
+                base_url=llm_config.base_url,
+                api_key=llm_config.api_key,
+                api_version=llm_config.api_version,
+                max_retries=0,
+                timeout=get_timeout(),
+                http_client=create_http_client(),
+            )
+        return AsyncOpenAI(
+            api_key=llm_config.api_key,
+            base_url=llm_config.base_url,
+            max_retries=0,
+            timeout=get_timeout(),
+            http_client=create_http_client(),
+        )
+
+    def _create_live_backend(
+        self, config_name: str, llm_config: LLMSettings
+    ) -> LLMBackend:
+        """The API backend, routing across `endpoints` if other configs are listed"""
+        if not llm_config.endpoints:
+            return OpenAIBackend(self.client)
+
+        endpoints = [Endpoint(config_name, OpenAIBackend(self.client), self.model)]
+        for name in llm_config.endpoints:
+            if name == config_name:
+                continue
+            if name not in config.llm:
+                raise ValueError(f"Unknown LLM config in endpoints: {name}")
+            settings = config.llm[name]
+            endpoints.append(
+                Endpoint(name, OpenAIBackend(self._create_client(settings)), settings.model)
+            )
+        return RouterBackend(
+            endpoints,
+            failover_timeout=llm_config.failover_timeout,
+            eject_after=llm_config.eject_after,
+            eject_seconds=llm_config.eject_seconds,
+            probe_seconds=llm_config.probe_seconds,
+        )
+
+    def get_backend_stats(self) -> Dict[str, Any]:
+        """Counters of the active backend, e.g. per-endpoint health when routing"""
+        return {"backend": self.backend.name, **self.backend.stats()}
+
+    def set_backend(self, backend: LLMBackend) -> None:
+        """Route all requests of this LLM through `backend` (e.g. a FakeBackend in tests)"""
+        self.backend.close()
+        self.backend = backend
+
+    def set_token_counting(self, mode: str) -> None:
+        """
+        Count input tokens with the tokenizer ("exact") or from text length
+        ("estimate", calibrated against the prompt tokens the API reports)
+        """
+        if mode not in TOKEN_COUNTING_MODES:
+            raise ValueError(
+                f"Invalid token_counting: {mode} (expected one of {TOKEN_COUNTING_MODES})"
+            )
+        self.token_counting = mode
+        self.token_estimator = TokenEstimator() if mode == "estimate" else None
+        self.token_count_errors = TokenCountErrors()
+
+    @property
+    def token_count_key(self) -> str:
+        """Key of cached per-message token counts for the current counting mode"""
+        if self.token_estimator is not None:
+            return self.token_estimator.cache_key
+        return self.tokenizer.name
+
+    def calibrate_token_count(self, counted: int, actual: int) -> None:
+        """Compare a local input token count with the API's prompt_tokens"""
+        self.token_count_errors.record(counted, actual)
+        if self.token_estimator is not None:
+            self.token_estimator.calibrate(counted, actual)
+
+    def get_token_count_error(self) -> Dict[str, Any]:
+        """Observed error of local input token counts against the API's counts"""
+        report = {"mode": self.token_counting, **self.token_count_errors.report()}
+        if self.token_estimator is not None:
+            report["factor"] = round(self.token_estimator.factor, 4)
+        return report
 
     def count_tokens(self, content: Union[str, List[Dict[str, Any]]]) -> int:
         """Calculate tokens for text/multimedia messages according to OpenAI rules"""
@@ -93,6 +495,8 @@ class LLM:
 
         def process_text(text: str) -> int:
             """Process text segments"""
+            if self.token_estimator is not None:
+                return self.token_estimator.count(text)
             return len(self.tokenizer.encode(text)) if text else 0
 
         def process_image(image_url: Dict[str, Any]) -> int:
@@ -105,28 +509,40 @@ class LLM:
             if detail == "low":
                 return base_tokens
             
+            url = image_url.get("url", "")
+            if is_blob_url(url):
+                blob = blob_store.get(url)
+                if blob is None:
+                    # Evicted, or recorded by another process (e.g. a replayed cassette)
+                    warnings.warn(f"Image {url} is not in the blob store, using default tokens")
+                    return base_tokens * 2  # Conservative estimate
+                if blob.size is not None:
+                    return estimate_image_tokens(*blob.size, detail)
+                url = blob.data_url
+            if not url.startswith("data:"):
+                # For external URLs would need to download, here we skip
+                warnings.warn("External image URLs require download, using default 85 tokens")
+                return base_tokens * 2  # Conservative estimate
+
+            # Repeated images (e.g. scene frames kept in memory) hit the cache
+            cache_key = ImageTokenCache.make_key(url, detail)
+            cached_tokens = self.image_token_cache.get(cache_key)
+            if cached_tokens is not None:
+                return cached_tokens
+
             # For high/auto detail, calculate tiles
             try:
-                # Extract image data
-                if image_url["url"].startswith("data:"):
-                    header, data = image_url["url"].split(",", 1)
+                # Read dimensions from the PNG/JPEG header, fall back to a full PIL decode
+                dimensions = probe_data_url_size(url)
+                if dimensions is None:
+                    header, data = url.split(",", 1)
                     image_data = base64.b64decode(data)
-                else:
-                    # For external URLs would need to download, here we skip
-                    warnings.warn("External image URLs require download, using default 85 tokens")
-                    return base_tokens * 2  # Conservative estimate
-
-                # Get image dimensions
-                with Image.open(BytesIO(image_data)) as img:
-                    width, height = img.size
-
-                # Calculate tiles (512x512 chunks)
-                tiles_width = math.ceil(width / 512)
-                tiles_height = math.ceil(height / 512)
-                total_tiles = tiles_width * tiles_height
-
-                # Token calculation formula
-                return base_tokens + (total_tiles * 170)
+                    with Image.open(BytesIO(image_data)) as img:
+                        dimensions = img.size
+                # Base cost plus 170 tokens per 512x512 tile
+                tokens = estimate_image_tokens(*dimensions, detail)
+                self.image_token_cache.put(cache_key, tokens)
+                return tokens
             
             except Exception as e:
                 warnings.warn(f"Image processing failed: {str(e)}, using base tokens")
@@ -158,71 +574,325 @@ class LLM:
             warnings.warn("Unsupported content format")
             return 0
 
-    def count_message_tokens(self, messages: List[dict]) -> int:
-        """Calculate the number of tokens in a message list"""
+    def count_message_tokens(self, messages: List[Union[dict, Message]]) -> int:
+        """
+        Calculate the number of tokens in a message list.
+
+        Token counts of Message objects are cached on the message, so only messages
+        that have not been counted before are tokenized.
+        """
+        encoding = self.token_count_key
         token_count = 0
         for message in messages:
-            # Base token count for each message (according to OpenAI's calculation method)
-            token_count += 4  # Base token count for each message
-
-            # Calculate tokens for the role
-            if "role" in message:
-                token_count += self.count_tokens(message["role"])
-            # Calculate tokens for the content
-            if "content" in message and message["content"]:
-                token_count += self.count_tokens(message["content"])
-            # Calculate tokens for tool calls
-            if "tool_calls" in message and message["tool_calls"]:
-                for tool_call in message["tool_calls"]:
-                    if "function" in tool_call:
-                        # Function name
-                        if "name" in tool_call["function"]:
-                            token_count += self.count_tokens(
-                                tool_call["function"]["name"]
-                            )
-                        # Function arguments
-                        if "arguments" in tool_call["function"]:
-                            token_count += self.count_tokens(
-                                tool_call["function"]["arguments"]
-                            )
-
-            # Calculate tokens for tool responses
-            if "name" in message and message["name"]:
-                token_count += self.count_tokens(message["name"])
-
-            if "tool_call_id" in message and message["tool_call_id"]:
-                token_count += self.count_tokens(message["tool_call_id"])
+            if isinstance(message, Message):
+                # Same filter as format_messages: such messages are not sent
+                if message.content is None and message.tool_calls is None:
+                    continue
+                message_tokens = message.get_token_count(encoding)
+                if message_tokens is None:
+                    message_tokens = self._count_single_message(message.to_dict())
+                    message.set_token_count(encoding, message_tokens)
+                token_count += message_tokens
+            else:
+                if "content" not in message and "tool_calls" not in message:
+                    continue
+                token_count += self._count_single_message(message)
 
         # Add extra tokens for message format
         token_count += 2  # Extra tokens for message format
 
         return token_count
 
-    def update_token_count(self, input_tokens: int) -> None:
+    def _count_single_message(self, message: dict) -> int:
+        """Calculate the number of tokens in a single message dict"""
+        # Base token count for each message (according to OpenAI's calculation method)
+        token_count = 4  # Base token count for each message
+
+        # Calculate tokens for the role
+        if "role" in message:
+            token_count += self.count_tokens(message["role"])
+        # Calculate tokens for the content
+        if "content" in message and message["content"]:
+            token_count += self.count_tokens(message["content"])
+        # Calculate tokens for tool calls
+        if "tool_calls" in message and message["tool_calls"]:
+            for tool_call in message["tool_calls"]:
+                if "function" in tool_call:
+                    # Function name
+                    if "name" in tool_call["function"]:
+                        token_count += self.count_tokens(tool_call["function"]["name"])
+                    # Function arguments
+                    if "arguments" in tool_call["function"]:
+                        token_count += self.count_tokens(
+                            tool_call["function"]["arguments"]
+                        )
+
+        # Calculate tokens for tool responses
+        if "name" in message and message["name"]:
+            token_count += self.count_tokens(message["name"])
+
+        if "tool_call_id" in message and message["tool_call_id"]:
+            token_count += self.count_tokens(message["tool_call_id"])
+
+        return token_count
+
+    @staticmethod
+    def tool_fingerprint(tool: dict) -> str:
+        """Return a stable hash of a tool's `to_param()` dict"""
+        serialized = json.dumps(tool, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.blake2b(serialized.encode("utf-8"), digest_size=16).hexdigest()
+
+    def count_tool_tokens(self, tool: dict) -> int:
+        """Calculate tokens for a tool definition, memoized by its fingerprint"""
+        fingerprint = self.tool_fingerprint(tool)
+        count_key = self.token_count_key
+        cached = self._tool_token_cache.get(fingerprint)
+        if cached is not None and cached[2] == count_key:
+            return cached[1]
+
+        tokens = self.count_tokens(str(tool))
+        name = tool.get("function", {}).get("name", tool.get("type", "unknown"))
+        self._tool_token_cache[fingerprint] = (name, tokens, count_key)
+        return tokens
+
+    def get_tool_token_costs(self) -> Dict[str, int]:
+        """Return the cached token cost of every tool seen so far, keyed by tool name"""
+        return {name: tokens for name, tokens, _ in self._tool_token_cache.values()}
+
+    @staticmethod
+    def get_cached_tokens(usage: Any) -> int:
+        """Read the number of prompt tokens served from the provider's prompt cache"""
+        if usage is None:
+            return 0
+        # OpenAI / Azure / DashScope compatible mode
+        details = getattr(usage, "prompt_tokens_details", None)
+        if details is not None:
+            cached = (
+                details.get("cached_tokens")
+                if isinstance(details, dict)
+                else getattr(details, "cached_tokens", None)
+            )
+            if cached:
+                return cached
+        # DeepSeek and Anthropic-compatible endpoints report it as extra fields
+        for field in ("prompt_cache_hit_tokens", "cache_read_input_tokens"):
+            cached = getattr(usage, field, None)
+            if cached:
+                return cached
+        return 0
+
+    def update_token_count(self, input_tokens: int, cached_tokens: int = 0) -> None:
         """Update token counts"""
         # Only track tokens if max_input_tokens is set
         self.total_input_tokens += input_tokens
+        self.total_cached_tokens += cached_tokens
         logger.info(
-            f"Token usage: Input={input_tokens}, Cumulative Input={self.total_input_tokens}"
+            f"Token usage: Input={input_tokens}, Cached={cached_tokens}, "
+            f"Cumulative Input={self.total_input_tokens}, "
+            f"Cumulative Cached={self.total_cached_tokens}"
         )
 
+    def get_prompt_cache_stats(self) -> Dict[str, Any]:
+        """Return how many prompt tokens were served from the provider's cache"""
+        return _prompt_cache_stats(self.total_input_tokens, self.total_cached_tokens)
+
+    @classmethod
+    def get_total_prompt_cache_stats(cls) -> Dict[str, Any]:
+        """Return prompt cache stats summed over all LLM configurations"""
+        return _prompt_cache_stats(
+            sum(llm.total_input_tokens for llm in cls._instances.values()),
+            sum(llm.total_cached_tokens for llm in cls._instances.values()),
+        )
+
+    def limit_tokens(self, input_tokens: int) -> int:
+        """Counted input tokens as charged against the limits"""
+        if self.token_estimator is not None:
+            # Estimates may undercount: leave room for the observed error
+            return self.token_count_errors.upper_bound(input_tokens)
+        return input_tokens
+
     def check_token_limit(self, input_tokens: int) -> bool:
         """Check if token limits are exceeded"""
+        input_tokens = self.limit_tokens(input_tokens)
         if self.max_input_tokens is not None:
             return (self.total_input_tokens + input_tokens) <= self.max_input_tokens
         # If max_input_tokens is not set, always return True
         return True
 
+    def input_token_budget(self) -> Optional[int]:
+        """
+        Counted input tokens a single request may use (None if unlimited).
+
+        This is the per-request `context_window`; the session-wide
+        `max_input_tokens` is enforced by `check_token_limit` and is not a reason
+        to cut history. In estimate mode the budget is reduced by the same margin
+        that `check_token_limit` adds, so a history fitted to it passes the check.
+        """
+        if self.context_window is None:
+            return None
+        budget = self.context_window
+        if self.token_estimator is not None:
+            budget = math.floor(budget / (1 + self.token_count_errors.margin()))
+        return budget
+
     def get_limit_error_message(self, input_tokens: int) -> str:
         """Generate error message for token limit exceeded"""
+        limit_tokens = self.limit_tokens(input_tokens)
         if (
             self.max_input_tokens is not None
-            and (self.total_input_tokens + input_tokens) > self.max_input_tokens
+            and (self.total_input_tokens + limit_tokens) > self.max_input_tokens
         ):
-            return f"Request may exceed input token limit (Current: {self.total_input_tokens}, Needed: {input_tokens}, Max: {self.max_input_tokens})"
+            needed = (
+                f"{limit_tokens} (estimated {input_tokens} plus error margin)"
+                if limit_tokens != input_tokens
+                else f"{input_tokens}"
+            )
+            return f"Request may exceed input token limit (Current: {self.total_input_tokens}, Needed: {needed}, Max: {self.max_input_tokens})"
 
         return "Token limit exceeded"
 
+    def _record_usage(
+        self,
+        method: str,
+        started: float,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cached_tokens: int = 0,
+        time_to_first_token: Optional[float] = None,
+        response_cached: bool = False,
+        error: Optional[BaseException] = None,
+        hedged: bool = False,
+        hedge_won: bool = False,
+    ) -> None:
+        """Add one call to the usage ledger, attributed to the current caller and flow"""
+        latency = time.perf_counter() - started
+        usage_ledger.record(
+            UsageRecord(
+                config_name=self.config_name,
+                model=self.model,
+                method=method,
+                caller=get_current_caller(),
+                flow_id=get_current_flow(),
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                cached_tokens=cached_tokens,
+                latency=latency,
+                time_to_first_token=(
+                    time_to_first_token
+                    if time_to_first_token is not None or error is not None
+                    else latency
+                ),
+                response_cached=response_cached,
+                hedged=hedged,
+                hedge_won=hedge_won,
+                error=f"{type(error).__name__}: {error}" if error else None,
+            )
+        )
+
+    def _latency_window(self, method: str) -> Deque[float]:
+        """Recent API latencies of `method` calls made by the current caller"""
+        site = f"{method}:{get_current_caller()}"
+        window = self._latency_samples.get(site)
+        if window is None:
+            window = self._latency_samples[site] = deque(maxlen=200)
+        return window
+
+    async def _create_completion(
+        self, params: dict, input_tokens: int, method: str = "ask"
+    ) -> Any:
+        """Send one non-streaming chat completion request through the rate limiter"""
+        async with self.rate_limiter.limit(input_tokens):
+            # Only the API call is timed, not the wait for a rate limiter slot
+            started = time.perf_counter()
+            response = await self.backend.create(**params)
+            self._latency_window(method).append(time.perf_counter() - started)
+        if response.usage:
+            self.rate_limiter.record_usage(input_tokens, response.usage.total_tokens)
+        return response
+
+    def get_hedge_delay(self, method: str = "ask_tool") -> Optional[float]:
+        """
+        Seconds to wait before hedging a `method` call from the current caller, or
+        None if hedging is off or not yet calibrated for that call site
+        """
+        if self.hedge_percentile is None:
+            return None
+        window = self._latency_window(method)
+        if len(window) < self.hedge_min_samples:
+            return None
+        return percentile(list(window), self.hedge_percentile)
+
+    async def _create_completion_hedged(
+        self, params: dict, input_tokens: int
+    ) -> Tuple[Any, bool, bool]:
+        """
+        Send a request and, if it is slower than the hedge delay, a duplicate of it.
+
+        The first successful response wins and the other request is cancelled.
+
+        Returns:
+            (response, hedged, hedge_won)
+        """
+        primary = asyncio.ensure_future(
+            self.retry_policy.call(
+                self._create_completion, params, input_tokens, "ask_tool"
+            )
+        )
+        delay = self.get_hedge_delay("ask_tool")
+        if delay is None:
+            return await primary, False, False
+
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result(), False, False
+
+            self.hedged_requests += 1
+            logger.info(f"No response after {delay:.2f}s, sending hedged request")
+            hedge = asyncio.ensure_future(
+                self.retry_policy.call(
+                    self._create_completion, params, input_tokens, "ask_tool"
+                )
+            )
+            pending.add(hedge)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result(), True, task is hedge
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def get_response_cache_key(
+        self,
+        kind: str,
+        messages: List[dict],
+        temperature: Optional[float] = None,
+        **request: Any,
+    ) -> Optional[str]:
+        """Return the response cache key, or None if the request must not be cached"""
+        if self.response_cache is None or self.model in REASONING_MODELS:
+            return None
+        # Only deterministic requests are safe to replay
+        if (temperature if temperature is not None else self.temperature) != 0:
+            return None
+        return ResponseCache.make_key(
+            kind=kind,
+            model=self.model,
+            max_tokens=self.max_tokens,
+            messages=messages,
+            **request,
+        )
+
     @staticmethod
     def format_messages(messages: List[Union[dict, Message]]) -> List[dict]:
         """
@@ -268,19 +938,63 @@ class LLM:
 
         return formatted_messages
 
-    @retry(
-        wait=wait_random_exponential(min=1, max=60),
-        stop=stop_after_attempt(6),
-        retry=retry_if_exception_type(
-            (OpenAIError, Exception, ValueError)
-        ),  # Don't retry TokenLimitExceeded
-    )
+    def _prepare_request(
+        self,
+        messages: List[Union[dict, Message]],
+        system_msgs: Optional[List[Union[dict, Message]]],
+        temperature: Optional[float],
+    ) -> Tuple[dict, List[Union[dict, Message]]]:
+        """
+        Validate a plain chat request and build its completion parameters.
+
+        Returns:
+            The request params and the unformatted messages (for token counting)
+        """
+        # Keep the original objects so cached per-message token counts are reused
+        raw_messages = (system_msgs or []) + messages
+
+        # Format system and user messages
+        if system_msgs:
+            system_msgs = self.format_messages(system_msgs)
+            messages = system_msgs + self.format_messages(messages)
+        else:
+            messages = self.format_messages(messages)
+
+        params = {
+            "model": self.model,
+            "messages": messages,
+        }
+
+        if self.model in REASONING_MODELS:
+            params["max_completion_tokens"] = self.max_tokens
+        else:
+            params["max_tokens"] = self.max_tokens
+            params["temperature"] = (
+                temperature if temperature is not None else self.temperature
+            )
+        return params, raw_messages
+
+    def _count_request_tokens(self, raw_messages: List[Union[dict, Message]]) -> int:
+        """Count input tokens of a request and enforce the token limit"""
+        # Calculate input token count
+        input_tokens = self.count_message_tokens(raw_messages)
+
+        # Check if token limits are exceeded
+        if not self.check_token_limit(input_tokens):
+            error_message = self.get_limit_error_message(input_tokens)
+            # Raise a special exception that won't be retried
+            raise TokenLimitExceeded(error_message)
+        return input_tokens
+
     async def ask(
         self,
         messages: List[Union[dict, Message]],
         system_msgs: Optional[List[Union[dict, Message]]] = None,
         stream: bool = True,
         temperature: Optional[float] = None,
+        stream_handler: Optional[
+            Callable[[StreamEvent], Union[None, Awaitable[None]]]
+        ] = console_echo,
     ) -> str:
         """
         Send a prompt to the LLM and get the response.
@@ -290,6 +1004,8 @@ class LLM:
             system_msgs: Optional system messages to prepend
             stream (bool): Whether to stream the response
             temperature (float): Sampling temperature for the response
+            stream_handler: Receives every StreamEvent when streaming (prints to
+                stdout by default, None to stay silent)
 
         Returns:
             str: The generated response
@@ -300,95 +1016,242 @@ class LLM:
             OpenAIError: If API call fails after retries
             Exception: For unexpected errors
         """
+        if stream:
+            full_response = ""
+            async for event in self.ask_stream(
+                messages, system_msgs=system_msgs, temperature=temperature
+            ):
+                if stream_handler is not None:
+                    result = stream_handler(event)
+                    if inspect.isawaitable(result):
+                        await result
+                if event.done:
+                    full_response = event.text
+            return full_response
+
+        started = time.perf_counter()
         try:
-            # Format system and user messages
-            if system_msgs:
-                system_msgs = self.format_messages(system_msgs)
-                messages = system_msgs + self.format_messages(messages)
-            else:
-                messages = self.format_messages(messages)
+            params, raw_messages = self._prepare_request(
+                messages, system_msgs, temperature
+            )
 
-            # Calculate input token count
-            input_tokens = self.count_message_tokens(messages)
+            # Serve identical deterministic requests from the response cache
+            cache_key = self.get_response_cache_key(
+                "ask", params["messages"], temperature
+            )
+            if cache_key:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    logger.info("Response cache hit for ask")
+                    self._record_usage("ask", started, response_cached=True)
+                    return cached
 
-            # Check if token limits are exceeded
-            if not self.check_token_limit(input_tokens):
-                error_message = self.get_limit_error_message(input_tokens)
-                # Raise a special exception that won't be retried
-                raise TokenLimitExceeded(error_message)
+            input_tokens = self._count_request_tokens(raw_messages)
 
-            params = {
-                "model": self.model,
-                "messages": messages,
-            }
+            # Non-streaming request
+            params["stream"] = False
 
-            if self.model in REASONING_MODELS:
-                params["max_completion_tokens"] = self.max_tokens
-            else:
-                params["max_tokens"] = self.max_tokens
-                params["temperature"] = (
-                    temperature if temperature is not None else self.temperature
-                )
+            response = await self.retry_policy.call(
+                self._create_completion, params, input_tokens
+            )
 
-            if not stream:
-                # Non-streaming request
-                params["stream"] = False
+            if not response.choices or not response.choices[0].message.content:
+                raise ValueError("Empty or invalid response from LLM")
 
-                response = await self.client.chat.completions.create(**params)
+            # Update token counts
+            cached_tokens = self.get_cached_tokens(response.usage)
+            self.update_token_count(response.usage.prompt_tokens, cached_tokens)
+            self.calibrate_token_count(input_tokens, response.usage.prompt_tokens)
+            self._record_usage(
+                "ask",
+                started,
+                prompt_tokens=response.usage.prompt_tokens,
+                completion_tokens=response.usage.completion_tokens,
+                cached_tokens=cached_tokens,
+            )
+
+            if cache_key:
+                self.response_cache.put(cache_key, response.choices[0].message.content)
 
-                if not response.choices or not response.choices[0].message.content:
-                    raise ValueError("Empty or invalid response from LLM")
+            return response.choices[0].message.content
 
-                # Update token counts
-                self.update_token_count(response.usage.prompt_tokens)
+        except TokenLimitExceeded:
+            # Re-raise token limit errors without logging
+            raise
+        except ValueError as ve:
+            logger.error(f"Validation error: {ve}")
+            raise
+        except OpenAIError as oe:
+            self._record_usage("ask", started, error=oe)
+            logger.error(f"OpenAI API error: {oe}")
+            if isinstance(oe, AuthenticationError):
+                logger.error("Authentication failed. Check API key.")
+            elif isinstance(oe, RateLimitError):
+                logger.error("Rate limit exceeded. Consider increasing retry attempts.")
+            elif isinstance(oe, APIError):
+                logger.error(f"API error: {oe}")
+            raise
+        except Exception as e:
+            self._record_usage("ask", started, error=e)
+            logger.error(f"Unexpected error in ask: {e}")
+            raise
 
-                return response.choices[0].message.content
+    async def ask_stream(
+        self,
+        messages: List[Union[dict, Message]],
+        system_msgs: Optional[List[Union[dict, Message]]] = None,
+        temperature: Optional[float] = None,
+        include_usage: bool = False,
+    ) -> AsyncIterator[StreamEvent]:
+        """
+        Stream a response as StreamEvents without printing anything.
 
-            # Streaming request, For streaming, update estimated token count before making the request
-            self.update_token_count(input_tokens)
+        Every text delta is yielded with its timing; the final event has
+        `done=True` and carries the full text and token usage.
+
+        Args:
+            messages: List of conversation messages
+            system_msgs: Optional system messages to prepend
+            temperature: Sampling temperature for the response
+            include_usage: Ask the provider for exact usage in the last chunk
+                (`stream_options`); otherwise the prompt tokens are estimated
+
+        Yields:
+            StreamEvent: Deltas followed by one final event
+
+        Raises:
+            TokenLimitExceeded: If token limits are exceeded
+            ValueError: If messages are invalid or response is empty
+            OpenAIError: If API call fails after retries
+        """
+        started = time.perf_counter()
+        try:
+            params, raw_messages = self._prepare_request(
+                messages, system_msgs, temperature
+            )
+
+            # Serve identical deterministic requests from the response cache
+            cache_key = self.get_response_cache_key(
+                "ask", params["messages"], temperature
+            )
+            if cache_key:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    logger.info("Response cache hit for ask_stream")
+                    self._record_usage("ask_stream", started, response_cached=True)
+                    elapsed = time.perf_counter() - started
+                    yield StreamEvent(
+                        delta=cached,
+                        elapsed=elapsed,
+                        time_to_first_token=elapsed,
+                        cached=True,
+                    )
+                    yield StreamEvent(
+                        done=True,
+                        index=1,
+                        text=cached,
+                        elapsed=elapsed,
+                        time_to_first_token=elapsed,
+                        cached=True,
+                    )
+                    return
+
+            input_tokens = self._count_request_tokens(raw_messages)
 
             params["stream"] = True
-            response = await self.client.chat.completions.create(**params)
+            if include_usage:
+                params["stream_options"] = {"include_usage": True}
 
             collected_messages = []
+            time_to_first_token = None
+            usage = None
+            # The rate limiter slot covers opening the stream, not the time the
+            # consumer spends on each event
+            async with self.rate_limiter.limit(input_tokens):
+                response = await self.retry_policy.call(
+                    self.backend.create, **params
+                )
+
             async for chunk in response:
-                chunk_message = chunk.choices[0].delta.content or ""
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                chunk_message = chunk.choices[0].delta.content
+                if not chunk_message:
+                    continue
+                elapsed = time.perf_counter() - started
+                if time_to_first_token is None:
+                    time_to_first_token = elapsed
+                yield StreamEvent(
+                    delta=chunk_message,
+                    index=len(collected_messages),
+                    elapsed=elapsed,
+                    time_to_first_token=time_to_first_token,
+                )
                 collected_messages.append(chunk_message)
-                print(chunk_message, end="", flush=True)
 
-            print()  # Newline after streaming
             full_response = "".join(collected_messages).strip()
             if not full_response:
                 raise ValueError("Empty response from streaming LLM")
 
-            return full_response
+            if usage is not None:
+                usage_info = {
+                    "prompt_tokens": usage.prompt_tokens,
+                    "completion_tokens": usage.completion_tokens,
+                    "total_tokens": usage.total_tokens,
+                    "cached_tokens": self.get_cached_tokens(usage),
+                }
+                self.calibrate_token_count(input_tokens, usage.prompt_tokens)
+            else:
+                # No usage reported: fall back to local estimates
+                completion_tokens = self.count_tokens(full_response)
+                usage_info = {
+                    "prompt_tokens": input_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": input_tokens + completion_tokens,
+                    "cached_tokens": 0,
+                }
+            self.update_token_count(
+                usage_info["prompt_tokens"], usage_info["cached_tokens"]
+            )
+            self.rate_limiter.record_usage(input_tokens, usage_info["total_tokens"])
+            self._record_usage(
+                "ask_stream",
+                started,
+                prompt_tokens=usage_info["prompt_tokens"],
+                completion_tokens=usage_info["completion_tokens"],
+                cached_tokens=usage_info["cached_tokens"],
+                time_to_first_token=time_to_first_token,
+            )
+
+            if cache_key:
+                self.response_cache.put(cache_key, full_response)
+
+            yield StreamEvent(
+                done=True,
+                index=len(collected_messages),
+                text=full_response,
+                elapsed=time.perf_counter() - started,
+                time_to_first_token=time_to_first_token,
+                usage=usage_info,
+            )
 
         except TokenLimitExceeded:
             # Re-raise token limit errors without logging
             raise
         except ValueError as ve:
-            logger.error(f"Validation error: {ve}")
+            logger.error(f"Validation error in ask_stream: {ve}")
             raise
         except OpenAIError as oe:
+            self._record_usage("ask_stream", started, error=oe)
             logger.error(f"OpenAI API error: {oe}")
-            if isinstance(oe, AuthenticationError):
-                logger.error("Authentication failed. Check API key.")
-            elif isinstance(oe, RateLimitError):
-                logger.error("Rate limit exceeded. Consider increasing retry attempts.")
-            elif isinstance(oe, APIError):
-                logger.error(f"API error: {oe}")
             raise
         except Exception as e:
-            logger.error(f"Unexpected error in ask: {e}")
+            self._record_usage("ask_stream", started, error=e)
+            logger.error(f"Unexpected error in ask_stream: {e}")
             raise
 
-    @retry(
-        wait=wait_random_exponential(min=1, max=60),
-        stop=stop_after_attempt(6),
-        retry=retry_if_exception_type(
-            (OpenAIError, Exception, ValueError)
-        ),  # Don't retry TokenLimitExceeded
-    )
     async def ask_tool(
         self,
         messages: List[Union[dict, Message]],
@@ -397,11 +1260,20 @@ class LLM:
         tools: Optional[List[dict]] = None,
         tool_choice: TOOL_CHOICE_TYPE = ToolChoice.AUTO,  # type: ignore
         temperature: Optional[float] = None,
+        hedge: bool = False,
         **kwargs,
     ):
         """
         Ask LLM using functions/tools and return the response.
 
+        Identical requests issued while one is already in flight are coalesced
+        (unless `coalesce_requests` is off): they await the same call and receive
+        the same response object.
+
+        Hedged requests (`hedge=True`, with `hedge_percentile` configured) are sent
+        a second time if no response arrives within that percentile of recent
+        latencies; the first response wins.
+
         Args:
             messages: List of conversation messages
             system_msgs: Optional system messages to prepend
@@ -409,6 +1281,7 @@ class LLM:
             tools: List of tools to use
             tool_choice: Tool choice strategy
             temperature: Sampling temperature for the response
+            hedge: Duplicate the request if it is slow (for latency-critical calls)
             **kwargs: Additional completion arguments
 
         Returns:
@@ -420,56 +1293,193 @@ class LLM:
             OpenAIError: If API call fails after retries
             Exception: For unexpected errors
         """
+        if not self.coalesce_requests:
+            return await self._ask_tool(
+                messages,
+                system_msgs=system_msgs,
+                timeout=timeout,
+                tools=tools,
+                tool_choice=tool_choice,
+                temperature=temperature,
+                hedge=hedge,
+                **kwargs,
+            )
+
+        request_key = self._coalescing_key(
+            messages=self.format_messages((system_msgs or []) + messages),
+            tools=tools,
+            tool_choice=tool_choice,
+            temperature=temperature,
+            timeout=timeout,
+            hedge=hedge,
+            **kwargs,
+        )
+        task = self._inflight_requests.get(request_key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._ask_tool(
+                    messages,
+                    system_msgs=system_msgs,
+                    timeout=timeout,
+                    tools=tools,
+                    tool_choice=tool_choice,
+                    temperature=temperature,
+                    hedge=hedge,
+                    **kwargs,
+                )
+            )
+            self._inflight_requests[request_key] = task
+            task.add_done_callback(
+                lambda _: self._inflight_requests.pop(request_key, None)
+            )
+        else:
+            self.coalesced_requests += 1
+            logger.info("Coalescing identical in-flight ask_tool request")
+
+        # Shield the shared call so one cancelled caller does not cancel the others;
+        # once the last caller is gone, the call (and its rate limiter slot and
+        # retries) is cancelled too
+        self._inflight_waiters[request_key] = (
+            self._inflight_waiters.get(request_key, 0) + 1
+        )
         try:
-            # Validate tool_choice
-            if tool_choice not in TOOL_CHOICE_VALUES:
-                raise ValueError(f"Invalid tool_choice: {tool_choice}")
-
-            # Format messages
-            if system_msgs:
-                system_msgs = self.format_messages(system_msgs)
-                messages = system_msgs + self.format_messages(messages)
+            return await asyncio.shield(task)
+        finally:
+            waiters = self._inflight_waiters.get(request_key, 1) - 1
+            if waiters > 0:
+                self._inflight_waiters[request_key] = waiters
             else:
-                messages = self.format_messages(messages)
-            # Calculate input token count
-            input_tokens = self.count_message_tokens(messages)
-            # If there are tools, calculate token count for tool descriptions
-            tools_tokens = 0
-            if tools:
-                for tool in tools:
-                    tools_tokens += self.count_tokens(str(tool))
-
-            input_tokens += tools_tokens
-            # Check if token limits are exceeded
-            if not self.check_token_limit(input_tokens):
-                error_message = self.get_limit_error_message(input_tokens)
-                # Raise a special exception that won't be retried
-                raise TokenLimitExceeded(error_message)
-            # Validate tools if provided
-            if tools:
-                for tool in tools:
-                    if not isinstance(tool, dict) or "type" not in tool:
-                        raise ValueError("Each tool must be a dict with 'type' field")
-                    
-            # Set up the completion request
-            params = {
-                "model": self.model,
-                "messages": messages,
-                "tools": tools,
-                "tool_choice": tool_choice,
-                "timeout": timeout,
-                **kwargs,
-            }
+                self._inflight_waiters.pop(request_key, None)
+                if not task.done():
+                    task.cancel()
+
+    @staticmethod
+    def _coalescing_key(**request: Any) -> str:
+        """
+        Exact key of an ask_tool call: unlike cache keys, whitespace and call options
+        (timeout, hedge) count, so only truly identical calls share a response
+        """
+        serialized = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def _prepare_tool_request(
+        self,
+        messages: List[Union[dict, Message]],
+        system_msgs: Optional[List[Union[dict, Message]]],
+        timeout: int,
+        tools: Optional[List[dict]],
+        tool_choice: TOOL_CHOICE_TYPE,  # type: ignore
+        temperature: Optional[float],
+        **kwargs,
+    ) -> Tuple[dict, List[Union[dict, Message]]]:
+        """
+        Validate a tool-calling request and build its completion parameters.
+
+        Returns:
+            The request params and the unformatted messages (for token counting)
+        """
+        # Validate tool_choice
+        if tool_choice not in TOOL_CHOICE_VALUES:
+            raise ValueError(f"Invalid tool_choice: {tool_choice}")
+
+        # Keep the original objects so cached per-message token counts are reused
+        raw_messages = (system_msgs or []) + messages
 
-            if self.model in REASONING_MODELS:
-                params["max_completion_tokens"] = self.max_tokens
+        # Format messages
+        if system_msgs:
+            system_msgs = self.format_messages(system_msgs)
+            messages = system_msgs + self.format_messages(messages)
+        else:
+            messages = self.format_messages(messages)
+        # Validate tools if provided
+        if tools:
+            for tool in tools:
+                if not isinstance(tool, dict) or "type" not in tool:
+                    raise ValueError("Each tool must be a dict with 'type' field")
+
+        # Set up the completion request: system prompt, tools and history always
+        # serialize identically so the provider can cache the shared prefix
+        params = {
+            "model": self.model,
+            "messages": messages,
+            "tools": tools,
+            "tool_choice": tool_choice,
+            "timeout": timeout,
+            **kwargs,
+        }
+
+        if self.model in REASONING_MODELS:
+            params["max_completion_tokens"] = self.max_tokens
+        else:
+            params["max_tokens"] = self.max_tokens
+            params["temperature"] = (
+                temperature if temperature is not None else self.temperature
+            )
+        return params, raw_messages
+
+    def _count_tool_request_tokens(
+        self, raw_messages: List[Union[dict, Message]], tools: Optional[List[dict]]
+    ) -> int:
+        """Count input tokens of a tool-calling request and enforce the token limit"""
+        # Calculate input token count
+        input_tokens = self.count_message_tokens(raw_messages)
+        # If there are tools, calculate token count for tool descriptions
+        if tools:
+            for tool in tools:
+                input_tokens += self.count_tool_tokens(tool)
+
+        # Check if token limits are exceeded
+        if not self.check_token_limit(input_tokens):
+            error_message = self.get_limit_error_message(input_tokens)
+            # Raise a special exception that won't be retried
+            raise TokenLimitExceeded(error_message)
+        return input_tokens
+
+    async def _ask_tool(
+        self,
+        messages: List[Union[dict, Message]],
+        system_msgs: Optional[List[Union[dict, Message]]] = None,
+        timeout: int = 300,
+        tools: Optional[List[dict]] = None,
+        tool_choice: TOOL_CHOICE_TYPE = ToolChoice.AUTO,  # type: ignore
+        temperature: Optional[float] = None,
+        hedge: bool = False,
+        **kwargs,
+    ):
+        """Send a tool-calling request to the LLM (see `ask_tool`)"""
+        started = time.perf_counter()
+        try:
+            params, raw_messages = self._prepare_tool_request(
+                messages, system_msgs, timeout, tools, tool_choice, temperature, **kwargs
+            )
+
+            # Serve identical deterministic requests from the response cache
+            cache_key = self.get_response_cache_key(
+                "ask_tool",
+                params["messages"],
+                temperature,
+                tools=tools,
+                tool_choice=tool_choice,
+                **kwargs,
+            )
+            if cache_key:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    logger.info("Response cache hit for ask_tool")
+                    self._record_usage("ask_tool", started, response_cached=True)
+                    return ChatCompletionMessage.model_validate_json(cached)
+
+            input_tokens = self._count_tool_request_tokens(raw_messages, tools)
+
+            if hedge:
+                response, hedged, hedge_won = await self._create_completion_hedged(
+                    params, input_tokens
+                )
             else:
-                params["max_tokens"] = self.max_tokens
-                params["temperature"] = (
-                    temperature if temperature is not None else self.temperature
+                response = await self.retry_policy.call(
+                    self._create_completion, params, input_tokens, "ask_tool"
                 )
-
-            response = await self.client.chat.completions.create(**params)
+                hedged = hedge_won = False
             # print(Color.CYAN,format_chat_completion(response),Color.RESET)
             # Check if response is valid
             if not response.choices or not response.choices[0].message:
@@ -477,7 +1487,23 @@ class LLM:
                 raise ValueError("Invalid or empty response from LLM")
 
             # Update token counts
-            self.update_token_count(response.usage.prompt_tokens)
+            cached_tokens = self.get_cached_tokens(response.usage)
+            self.update_token_count(response.usage.prompt_tokens, cached_tokens)
+            self.calibrate_token_count(input_tokens, response.usage.prompt_tokens)
+            self._record_usage(
+                "ask_tool",
+                started,
+                prompt_tokens=response.usage.prompt_tokens,
+                completion_tokens=response.usage.completion_tokens,
+                cached_tokens=cached_tokens,
+                hedged=hedged,
+                hedge_won=hedge_won,
+            )
+
+            if cache_key:
+                self.response_cache.put(
+                    cache_key, response.choices[0].message.model_dump_json()
+                )
 
             return response.choices[0].message
 
@@ -488,6 +1514,7 @@ class LLM:
             logger.error(f"Validation error in ask_tool: {ve}")
             raise
         except OpenAIError as oe:
+            self._record_usage("ask_tool", started, error=oe)
             logger.error(f"OpenAI API error: {oe}")
             if isinstance(oe, AuthenticationError):
                 logger.error("Authentication failed. Check API key.")
@@ -497,5 +1524,217 @@ class LLM:
                 logger.error(f"API error: {oe}")
             raise
         except Exception as e:
+            self._record_usage("ask_tool", started, error=e)
             logger.error(f"Unexpected error in ask_tool: {e}")
             raise
+
+    async def ask_tool_stream(
+        self,
+        messages: List[Union[dict, Message]],
+        system_msgs: Optional[List[Union[dict, Message]]] = None,
+        timeout: int = 300,
+        tools: Optional[List[dict]] = None,
+        tool_choice: TOOL_CHOICE_TYPE = ToolChoice.AUTO,  # type: ignore
+        temperature: Optional[float] = None,
+        on_argument: Optional[
+            Callable[[ToolArgumentEvent], Union[None, Awaitable[None]]]
+        ] = None,
+        **kwargs,
+    ) -> ChatCompletionMessage:
+        """
+        Streaming variant of `ask_tool` that parses tool call arguments incrementally.
+
+        `on_argument` is called (and awaited if it returns an awaitable) as soon as a
+        top-level argument or an element of a top-level array argument is complete,
+        e.g. `steps[0]` of a plan while the remaining steps are still generated.
+
+        Args:
+            messages: List of conversation messages
+            system_msgs: Optional system messages to prepend
+            timeout: Request timeout in seconds
+            tools: List of tools to use
+            tool_choice: Tool choice strategy
+            temperature: Sampling temperature for the response
+            on_argument: Callback receiving each completed ToolArgumentEvent
+            **kwargs: Additional completion arguments
+
+        Returns:
+            ChatCompletionMessage: The assembled response, as returned by `ask_tool`
+
+        Raises:
+            TokenLimitExceeded: If token limits are exceeded
+            ValueError: If tools, tool_choice, or messages are invalid
+            OpenAIError: If API call fails after retries
+        """
+        started = time.perf_counter()
+        time_to_first_token = None
+        try:
+            params, raw_messages = self._prepare_tool_request(
+                messages, system_msgs, timeout, tools, tool_choice, temperature, **kwargs
+            )
+            input_tokens = self._count_tool_request_tokens(raw_messages, tools)
+
+            params["stream"] = True
+            accumulator = ToolCallStreamAccumulator()
+            collected_content = []
+            usage = None
+            # As in ask_stream, the slot is not held while callbacks run
+            async with self.rate_limiter.limit(input_tokens):
+                response = await self.retry_policy.call(
+                    self.backend.create, **params
+                )
+            async for chunk in response:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if time_to_first_token is None and (delta.content or delta.tool_calls):
+                    time_to_first_token = time.perf_counter() - started
+                if delta.content:
+                    collected_content.append(delta.content)
+                for event in accumulator.add_deltas(delta.tool_calls):
+                    if on_argument is None:
+                        continue
+                    result = on_argument(event)
+                    if inspect.isawaitable(result):
+                        await result
+
+            tool_calls = accumulator.to_tool_calls()
+            content = "".join(collected_content) or None
+            if not content and not tool_calls:
+                raise ValueError("Empty response from streaming LLM")
+
+            # Same bookkeeping as ask_tool, once the whole response has arrived
+            if usage is not None:
+                prompt_tokens = usage.prompt_tokens
+                completion_tokens = usage.completion_tokens
+                cached_tokens = self.get_cached_tokens(usage)
+                self.calibrate_token_count(input_tokens, prompt_tokens)
+            else:
+                # Streaming responses carry no usage by default, use the estimate
+                prompt_tokens = input_tokens
+                completion_tokens = self.count_tokens(
+                    (content or "")
+                    + "".join(call.function.arguments for call in tool_calls)
+                )
+                cached_tokens = 0
+            self.update_token_count(prompt_tokens, cached_tokens)
+            self.rate_limiter.record_usage(
+                input_tokens, prompt_tokens + completion_tokens
+            )
+            self._record_usage(
+                "ask_tool_stream",
+                started,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                cached_tokens=cached_tokens,
+                time_to_first_token=time_to_first_token,
+            )
+            return ChatCompletionMessage(
+                role="assistant", content=content, tool_calls=tool_calls or None
+            )
+
+        except TokenLimitExceeded:
+            raise
+        except ValueError as ve:
+            logger.error(f"Validation error in ask_tool_stream: {ve}")
+            raise
+        except OpenAIError as oe:
+            self._record_usage("ask_tool_stream", started, error=oe)
+            logger.error(f"OpenAI API error: {oe}")
+            raise
+        except Exception as e:
+            self._record_usage("ask_tool_stream", started, error=e)
+            logger.error(f"Unexpected error in ask_tool_stream: {e}")
+            raise
+
+    async def _run_batch(
+        self,
+        call: Callable[..., Awaitable[Any]],
+        requests: List[Dict[str, Any]],
+        concurrency: int,
+        timeout: Optional[float],
+    ) -> BatchResult:
+        """Run `call(**request)` for every request with bounded concurrency"""
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+        started = time.perf_counter()
+
+        async def run_one(index: int, request: Dict[str, Any]) -> BatchItemResult:
+            async with semaphore:
+                request_started = time.perf_counter()
+                # Usage of this request's own calls, whatever else runs meanwhile
+                with collect_usage() as records:
+                    try:
+                        # wait_for cancels the call on timeout; coalesced ask_tool
+                        # calls are cancelled once no other caller waits for them
+                        item = BatchItemResult(
+                            index=index,
+                            response=await asyncio.wait_for(call(**request), timeout),
+                        )
+                    except asyncio.TimeoutError:
+                        item = BatchItemResult(
+                            index=index,
+                            error=f"Timed out after {timeout}s",
+                            timed_out=True,
+                        )
+                    except Exception as e:
+                        item = BatchItemResult(
+                            index=index, error=f"{type(e).__name__}: {e}"
+                        )
+                item.latency = time.perf_counter() - request_started
+                item.prompt_tokens = sum(r.prompt_tokens for r in records)
+                item.completion_tokens = sum(r.completion_tokens for r in records)
+                return item
+
+        items = await asyncio.gather(
+            *(run_one(index, request) for index, request in enumerate(requests))
+        )
+        stats = summarize_batch(items, wall_time=time.perf_counter() - started)
+        logger.info(f"Batch finished: {stats}")
+        return BatchResult(items=items, stats=stats)
+
+    async def ask_batch(
+        self,
+        requests: List[Dict[str, Any]],
+        concurrency: int = 4,
+        timeout: Optional[float] = None,
+    ) -> BatchResult:
+        """
+        Run many `ask` requests with bounded concurrency, e.g. for offline evaluation.
+
+        Args:
+            requests: Keyword arguments for each `ask` call (`messages`, `system_msgs`, ...);
+                requests are not streamed unless they set `stream` explicitly
+            concurrency: Maximum number of requests in flight
+            timeout: Per-request timeout in seconds; a request running longer is
+                cancelled, releasing its rate limiter slot (None for no timeout)
+
+        Returns:
+            BatchResult: Per-request results in input order, with errors captured per
+            item, and aggregate latency/token statistics
+        """
+        requests = [{"stream": False, **request} for request in requests]
+        return await self._run_batch(self.ask, requests, concurrency, timeout)
+
+    async def ask_tool_batch(
+        self,
+        requests: List[Dict[str, Any]],
+        concurrency: int = 4,
+        timeout: Optional[float] = None,
+    ) -> BatchResult:
+        """
+        Run many `ask_tool` requests with bounded concurrency, e.g. to score planners.
+
+        Args:
+            requests: Keyword arguments for each `ask_tool` call
+                (`messages`, `system_msgs`, `tools`, `tool_choice`, ...)
+            concurrency: Maximum number of requests in flight
+            timeout: Per-request timeout in seconds; a request running longer is
+                cancelled, releasing its rate limiter slot (None for no timeout)
+
+        Returns:
+            BatchResult: Per-request results in input order, with errors captured per
+            item, and aggregate latency/token statistics
+        """
+        return await self._run_batch(self.ask_tool, requests, concurrency, timeout)
@@ -0,0 +1,410 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Union
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from app.blob_store import materialize_messages
+from app.exceptions import OpenManusError
+from app.logger import logger
+
+
+# Request fields that do not change the response and are left out of cassette keys
+_VOLATILE_FIELDS = {"timeout", "stream_options"}
+
+
+class CassetteMissError(OpenManusError):
+    """Raised in replay mode when a request was never recorded"""
+
+
+def cassette_key(params: Dict[str, Any]) -> str:
+    """Build the key a request is recorded and replayed under"""
+    request = {k: v for k, v in params.items() if k not in _VOLATILE_FIELDS}
+    serialized = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class LLMBackend(ABC):
+    """Sends chat completion requests; `LLM` talks to the API only through a backend"""
+
+    name = "base"
+
+    @abstractmethod
+    async def create(self, **params: Any) -> Any:
+        """
+        Send one chat completion request.
+
+        Returns a `ChatCompletion`, or an async iterator of `ChatCompletionChunk`
+        when `params["stream"]` is true.
+        """
+
+    def stats(self) -> Dict[str, Any]:
+        """Backend-specific counters (e.g. endpoint health or cassette hits)"""
+        return {}
+
+    def close(self) -> None:
+        """Release files or connections held by the backend"""
+
+
+class OpenAIBackend(LLMBackend):
+    """Live backend calling an (Azure) OpenAI-compatible API"""
+
+    name = "openai"
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    async def create(self, **params: Any) -> Any:
+        # Messages reference images by blob URL until they are sent
+        params["messages"] = materialize_messages(params["messages"])
+        return await self.client.chat.completions.create(**params)
+
+
+class _StreamRecorder:
+    """Passes a live stream through while collecting its chunks and timing"""
+
+    def __init__(
+        self,
+        stream: Any,
+        on_done: Callable[[List[dict], List[float]], None],
+        started: float,
+    ):
+        self._stream = stream
+        self._on_done = on_done
+        self._started = started
+        self._chunks: List[dict] = []
+        self._offsets: List[float] = []
+
+    def __aiter__(self) -> "_StreamRecorder":
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            chunk = await self._stream.__anext__()
+        except StopAsyncIteration:
+            self._on_done(self._chunks, self._offsets)
+            raise
+        self._chunks.append(chunk.model_dump(exclude_unset=True))
+        self._offsets.append(round(time.perf_counter() - self._started, 4))
+        return chunk
+
+
+class RecordingBackend(LLMBackend):
+    """
+    Forwards requests to another backend and appends each request/response pair,
+    with its latency, to a JSONL cassette that `ReplayBackend` can serve later.
+    """
+
+    name = "record"
+
+    def __init__(self, inner: LLMBackend, path: Union[str, Path]):
+        self.inner = inner
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.recorded += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": str(self.path), "recorded": self.recorded, **self.inner.stats()}
+
+    def close(self) -> None:
+        self.inner.close()
+
+    async def create(self, **params: Any) -> Any:
+        started = time.perf_counter()
+        response = await self.inner.create(**params)
+        entry = {
+            "key": cassette_key(params),
+            "recorded_at": time.time(),
+            "request": params,
+        }
+
+        if not params.get("stream"):
+            entry["latency"] = round(time.perf_counter() - started, 4)
+            entry["response"] = response.model_dump(exclude_unset=True)
+            self._write(entry)
+            return response
+
+        # Chunk offsets are measured from when the request was sent
+        def on_done(chunks: List[dict], offsets: List[float]) -> None:
+            entry["latency"] = round(time.perf_counter() - started, 4)
+            entry["time_to_first_token"] = offsets[0] if offsets else None
+            entry["chunks"] = chunks
+            entry["chunk_offsets"] = offsets
+            self._write(entry)
+
+        return _StreamRecorder(response, on_done, started)
+
+
+class _ReplayStream:
+    """Replays recorded chunks, sleeping between them to mimic the recorded timing"""
+
+    def __init__(self, chunks: List[dict], offsets: List[float], scale: float):
+        self._chunks = chunks
+        self._offsets = offsets or [0.0] * len(chunks)
+        self._scale = scale
+        self._index = 0
+        self._started = time.perf_counter()
+
+    def __aiter__(self) -> "_ReplayStream":
+        return self
+
+    async def __anext__(self) -> ChatCompletionChunk:
+        if self._index >= len(self._chunks):
+            raise StopAsyncIteration
+        if self._scale > 0:
+            due = self._offsets[self._index] * self._scale
+            delay = due - (time.perf_counter() - self._started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        chunk = ChatCompletionChunk.model_validate(self._chunks[self._index])
+        self._index += 1
+        return chunk
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Serves responses from a cassette written by `RecordingBackend`.
+
+    Identical requests recorded several times (e.g. an agent loop) are replayed in
+    recording order; once exhausted, the last recording is repeated.
+
+    Args:
+        path: JSONL cassette file
+        latency_scale: Multiplier on recorded latencies (0 replays instantly,
+            1 replays in real time)
+        latency: Fixed latency in seconds used instead of the recorded one
+        strict: Raise `CassetteMissError` for unrecorded requests; otherwise fall
+            back to `fallback`
+        fallback: Backend used for unrecorded requests when not strict
+    """
+
+    name = "replay"
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        latency_scale: float = 0.0,
+        latency: Optional[float] = None,
+        strict: bool = True,
+        fallback: Optional[LLMBackend] = None,
+    ):
+        self.path = Path(path)
+        self.latency_scale = latency_scale
+        self.latency = latency
+        self.strict = strict
+        self.fallback = fallback
+        self._entries: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._served: Dict[str, int] = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            raise FileNotFoundError(f"Cassette not found: {self.path}")
+        with self.path.open(encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(
+                        f"Skipping malformed cassette line {line_no} in {self.path}"
+                    )
+                    continue
+                if "response" not in entry and "chunks" not in entry:
+                    continue
+                key = entry.get("key") or cassette_key(entry.get("request", {}))
+                self._entries[key].append(entry)
+        logger.info(
+            f"Loaded {sum(len(v) for v in self._entries.values())} recorded LLM calls "
+            f"from {self.path}"
+        )
+
+    def _next_entry(self, key: str) -> Dict[str, Any]:
+        entries = self._entries[key]
+        index = min(self._served[key], len(entries) - 1)
+        self._served[key] += 1
+        return entries[index]
+
+    async def create(self, **params: Any) -> Any:
+        key = cassette_key(params)
+        if not self._entries.get(key):
+            self.misses += 1
+            if self.strict or self.fallback is None:
+                raise CassetteMissError(
+                    f"No recorded response for request {key[:12]} in {self.path}"
+                )
+            return await self.fallback.create(**params)
+
+        self.hits += 1
+        entry = self._next_entry(key)
+        if "chunks" in entry:
+            offsets = entry.get("chunk_offsets") or []
+            if self.latency is not None and offsets:
+                # Spread the fixed latency evenly over the chunks
+                step = self.latency / len(offsets)
+                offsets = [step * (i + 1) for i in range(len(offsets))]
+                return _ReplayStream(entry["chunks"], offsets, 1.0)
+            return _ReplayStream(entry["chunks"], offsets, self.latency_scale)
+
+        delay = (
+            self.latency
+            if self.latency is not None
+            else entry.get("latency", 0.0) * self.latency_scale
+        )
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return ChatCompletion.model_validate(entry["response"])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": str(self.path),
+            "recorded_requests": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+FakeResponse = Union[str, dict, BaseException, Callable[[Dict[str, Any]], Any]]
+
+
+class FakeBackend(LLMBackend):
+    """
+    Scriptable backend for tests.
+
+    Scripted responses are served in order. Each one may be a string (assistant
+    text), a dict of assistant message fields (e.g. with `tool_calls`), an exception
+    to raise, or a callable taking the request params and returning any of these.
+    When the script runs out, `default` is served.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        responses: Optional[List[FakeResponse]] = None,
+        default: Optional[FakeResponse] = "ok",
+        latency: float = 0.0,
+        model: str = "fake",
+    ):
+        self.responses: Deque[FakeResponse] = deque(responses or [])
+        self.default = default
+        self.latency = latency
+        self.model = model
+        self.calls: List[Dict[str, Any]] = []
+
+    def add(self, *responses: FakeResponse) -> "FakeBackend":
+        """Append responses to the script"""
+        self.responses.extend(responses)
+        return self
+
+    def _message(self, response: Any) -> Dict[str, Any]:
+        if isinstance(response, str):
+            return {"role": "assistant", "content": response}
+        message = {"role": "assistant", "content": None, **response}
+        for i, call in enumerate(message.get("tool_calls") or []):
+            call.setdefault("id", f"call_{i}")
+            call.setdefault("type", "function")
+            arguments = call.get("function", {}).get("arguments")
+            if isinstance(arguments, dict):
+                call["function"]["arguments"] = json.dumps(arguments)
+        return message
+
+    async def create(self, **params: Any) -> Any:
+        self.calls.append(params)
+        response = self.responses.popleft() if self.responses else self.default
+        if callable(response) and not isinstance(response, BaseException):
+            response = response(params)
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if isinstance(response, BaseException):
+            raise response
+        if response is None:
+            raise CassetteMissError("FakeBackend has no scripted response left")
+
+        message = self._message(response)
+        completion_tokens = len(json.dumps(message)) // 4
+        prompt_tokens = len(json.dumps(params.get("messages", []), default=str)) // 4
+        completion = {
+            "id": f"fake-{len(self.calls)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": params.get("model", self.model),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+        if not params.get("stream"):
+            return ChatCompletion.model_validate(completion)
+        return _ReplayStream(_to_chunks(completion), [], 0.0)
+
+
+def _to_chunks(completion: Dict[str, Any]) -> List[dict]:
+    """Split a completion into the chunks a streaming API would send"""
+    message = completion["choices"][0]["message"]
+    base = {
+        "id": completion["id"],
+        "object": "chat.completion.chunk",
+        "created": completion["created"],
+        "model": completion["model"],
+    }
+    chunks = []
+    for word in (message.get("content") or "").split(" "):
+        delta = {"content": f" {word}" if chunks else word}
+        chunks.append({**base, "choices": [{"index": 0, "delta": delta}]})
+    for i, call in enumerate(message.get("tool_calls") or []):
+        delta = {
+            "tool_calls": [
+                {
+                    "index": i,
+                    "id": call["id"],
+                    "type": "function",
+                    "function": call["function"],
+                }
+            ]
+        }
+        chunks.append({**base, "choices": [{"index": 0, "delta": delta}]})
+    chunks.append(
+        {
+            **base,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "usage": completion["usage"],
+        }
+    )
+    return chunks
+
+
+def create_backend(
+    mode: str,
+    live: LLMBackend,
+    cassette_path: Union[str, Path],
+    latency_scale: float = 0.0,
+) -> LLMBackend:
+    """Build the backend for the configured mode (openai, record or replay)"""
+    if mode == "openai":
+        return live
+    if mode == "record":
+        return RecordingBackend(live, cassette_path)
+    if mode == "replay":
+        return ReplayBackend(cassette_path, latency_scale=latency_scale)
+    raise ValueError(f"Unknown LLM backend: {mode} (expected openai, record or replay)")
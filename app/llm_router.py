@@ -0,0 +1,215 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from app.llm_backend import LLMBackend
+from app.logger import logger
+from app.retry_policy import is_retryable
+
+
+class EndpointHealth:
+    """Observed latency and error rate of one endpoint"""
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.latency: Optional[float] = None  # EWMA of successful request latency
+        self.error_rate = 0.0  # EWMA of failures (1) and successes (0)
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.last_attempt = 0.0  # time.monotonic() of the last request sent here
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.failovers = 0
+
+    def _update_error_rate(self, failed: bool) -> None:
+        self.error_rate = (1 - self.alpha) * self.error_rate + self.alpha * failed
+
+    def record_success(self, latency: float) -> None:
+        self.requests += 1
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self._update_error_rate(False)
+        self.latency = (
+            latency
+            if self.latency is None
+            else (1 - self.alpha) * self.latency + self.alpha * latency
+        )
+
+    def record_failure(self, latency: float) -> None:
+        self.requests += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self._update_error_rate(True)
+        # Slow failures (timeouts) also count against the latency estimate
+        if self.latency is not None:
+            self.latency = max(self.latency, latency)
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def is_healthy(self, now: float) -> bool:
+        """Available, and neither failing most requests nor without any success"""
+        if not self.is_available(now):
+            return False
+        if self.latency is None and self.failures:
+            return False
+        return self.error_rate < 0.5
+
+
+class Endpoint:
+    """One interchangeable API endpoint: a backend plus the model name it serves"""
+
+    def __init__(self, name: str, backend: LLMBackend, model: str):
+        self.name = name
+        self.backend = backend
+        self.model = model
+        self.health = EndpointHealth()
+
+    def score(self) -> float:
+        """Expected cost of sending a request here; lower is better"""
+        health = self.health
+        if health.latency is None:
+            # Unprobed endpoints go first, endpoints that never succeeded go last
+            return float("inf") if health.failures else 0.0
+        return health.latency * (1 + health.in_flight) * (1 + 4 * health.error_rate)
+
+
+class RouterBackend(LLMBackend):
+    """
+    Spreads requests across equivalent endpoints (e.g. several `[llm.*]` configs
+    serving the same model) by observed latency and error rate.
+
+    A request goes to the best-scoring endpoint. If it fails with a retryable error,
+    or gives no response within `failover_timeout`, it is sent to the next endpoint.
+    Endpoints failing `eject_after` times in a row are skipped for `eject_seconds`.
+    An endpoint the ranking has not chosen for `probe_seconds` (e.g. after a failed
+    first request or a slow spell) is sent the next request first, so its health
+    is measured again instead of it being abandoned for good.
+
+    Args:
+        endpoints: Endpoints in order of preference
+        failover_timeout: Seconds to wait for an endpoint before trying the next one
+            (None to wait for the request timeout)
+        eject_after: Consecutive failures before an endpoint is ejected
+        eject_seconds: How long an ejected endpoint is skipped
+        probe_seconds: How long an endpoint may go unchosen before it is probed
+    """
+
+    name = "router"
+
+    def __init__(
+        self,
+        endpoints: List[Endpoint],
+        failover_timeout: Optional[float] = None,
+        eject_after: int = 3,
+        eject_seconds: float = 30.0,
+        probe_seconds: float = 60.0,
+    ):
+        if not endpoints:
+            raise ValueError("RouterBackend needs at least one endpoint")
+        self.endpoints = endpoints
+        self.failover_timeout = failover_timeout
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.probe_seconds = probe_seconds
+        self.probes = 0
+
+    def ranked_endpoints(self) -> List[Endpoint]:
+        """
+        Available endpoints, best first; ejected endpoints only if none are left.
+
+        The worst endpoint not tried for `probe_seconds` is moved to the front.
+        """
+        now = time.monotonic()
+        available = [e for e in self.endpoints if e.health.is_available(now)]
+        if not available:
+            # Everything is ejected: try the endpoint that comes back first
+            available = sorted(self.endpoints, key=lambda e: e.health.ejected_until)
+        ranked = sorted(available, key=Endpoint.score)
+        stale = [
+            e
+            for e in ranked[1:]
+            if e.health.requests and now - e.health.last_attempt >= self.probe_seconds
+        ]
+        if stale:
+            probe = stale[-1]
+            ranked.remove(probe)
+            ranked.insert(0, probe)
+            self.probes += 1
+            logger.info(f"Probing LLM endpoint '{probe.name}' to refresh its health")
+        return ranked
+
+    async def _send(self, endpoint: Endpoint, params: Dict[str, Any]) -> Any:
+        request = endpoint.backend.create(**{**params, "model": endpoint.model})
+        if self.failover_timeout is None:
+            return await request
+        return await asyncio.wait_for(request, self.failover_timeout)
+
+    def _eject_if_needed(self, endpoint: Endpoint) -> None:
+        health = endpoint.health
+        if health.consecutive_failures >= self.eject_after:
+            health.ejected_until = time.monotonic() + self.eject_seconds
+            logger.warning(
+                f"Ejecting LLM endpoint '{endpoint.name}' for {self.eject_seconds:.0f}s "
+                f"after {health.consecutive_failures} consecutive failures"
+            )
+
+    async def create(self, **params: Any) -> Any:
+        ranked = self.ranked_endpoints()
+        last_error: Optional[BaseException] = None
+        for attempt, endpoint in enumerate(ranked):
+            health = endpoint.health
+            if attempt:
+                health.failovers += 1
+                logger.warning(
+                    f"Failing over to LLM endpoint '{endpoint.name}': {last_error!r}"
+                )
+            started = time.perf_counter()
+            health.last_attempt = time.monotonic()
+            health.in_flight += 1
+            try:
+                response = await self._send(endpoint, params)
+            except asyncio.TimeoutError as e:
+                health.record_failure(time.perf_counter() - started)
+                self._eject_if_needed(endpoint)
+                last_error = e
+                continue
+            except Exception as e:
+                if not is_retryable(e):
+                    # The request itself is bad, another endpoint would reject it too
+                    raise
+                health.record_failure(time.perf_counter() - started)
+                self._eject_if_needed(endpoint)
+                last_error = e
+                continue
+            finally:
+                health.in_flight -= 1
+            # Streams are measured to the first byte, the rest is generation time
+            health.record_success(time.perf_counter() - started)
+            return response
+
+        raise last_error
+
+    def stats(self) -> Dict[str, Any]:
+        """Health of every endpoint"""
+        now = time.monotonic()
+        return {
+            e.name: {
+                "model": e.model,
+                "healthy": e.health.is_healthy(now),
+                "latency": round(e.health.latency, 3) if e.health.latency else None,
+                "error_rate": round(e.health.error_rate, 3),
+                "consecutive_failures": e.health.consecutive_failures,
+                "requests": e.health.requests,
+                "failures": e.health.failures,
+                "failovers": e.health.failovers,
+                "in_flight": e.health.in_flight,
+                "score": round(e.score(), 3) if e.health.latency else None,
+            }
+            for e in self.endpoints
+        }
+
+    def close(self) -> None:
+        for endpoint in self.endpoints:
+            endpoint.backend.close()
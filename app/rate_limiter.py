@@ -0,0 +1,165 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from app.logger import logger
+
+
+class TokenBucket:
+    """A bucket refilled continuously at `capacity` units per minute"""
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.level = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        elapsed = now - self.updated_at
+        self.level = min(self.capacity, self.level + elapsed * self.capacity / 60.0)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 if available now)"""
+        missing = amount - self.level
+        if missing <= 0:
+            return 0.0
+        return missing * 60.0 / self.capacity
+
+    def consume(self, amount: float) -> None:
+        # The level may go negative when usage is corrected after the fact
+        self.level -= amount
+
+
+class RateLimiter:
+    """
+    Client-side limiter for one LLM configuration.
+
+    Requests queue locally until the requests-per-minute and tokens-per-minute
+    buckets can cover them and a concurrency slot is free, instead of being
+    rejected by the provider with 429 errors. Limits set to None are not enforced.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+    ):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+
+        self._request_bucket = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self._token_bucket = (
+            TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        )
+
+        # asyncio primitives are bound to the loop they are first used in
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.total_requests = 0
+        self.throttled_requests = 0
+        self.total_wait_time = 0.0
+        self.in_flight = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(
+            self.requests_per_minute or self.tokens_per_minute or self.max_concurrency
+        )
+
+    def _ensure_primitives(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._semaphore = (
+                asyncio.Semaphore(self.max_concurrency)
+                if self.max_concurrency
+                else None
+            )
+
+    async def _wait_for_budget(self, tokens: int) -> None:
+        """Block until both buckets can cover the request, then consume from them"""
+        if self._token_bucket:
+            # A request larger than the whole bucket could never run otherwise
+            tokens = min(tokens, self._token_bucket.capacity)
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = 0.0
+                if self._request_bucket:
+                    self._request_bucket.refill(now)
+                    wait = max(wait, self._request_bucket.wait_time(1))
+                if self._token_bucket:
+                    self._token_bucket.refill(now)
+                    wait = max(wait, self._token_bucket.wait_time(tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            if self._request_bucket:
+                self._request_bucket.consume(1)
+            if self._token_bucket:
+                self._token_bucket.consume(tokens)
+
+    @asynccontextmanager
+    async def limit(self, tokens: int = 0) -> AsyncIterator[None]:
+        """
+        Hold a rate-limit slot for the duration of one API call.
+
+        Args:
+            tokens: Estimated tokens of the request (usually the input token count)
+        """
+        self.total_requests += 1
+        if not self.enabled:
+            yield
+            return
+
+        self._ensure_primitives()
+        started = time.monotonic()
+        if self._semaphore:
+            await self._semaphore.acquire()
+        try:
+            await self._wait_for_budget(tokens)
+            waited = time.monotonic() - started
+            if waited > 0.01:
+                self.throttled_requests += 1
+                self.total_wait_time += waited
+                logger.debug(
+                    f"Rate limiter '{self.name}' queued request for {waited:.2f}s"
+                )
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+        finally:
+            if self._semaphore:
+                self._semaphore.release()
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Correct the token bucket once the provider reports the real usage"""
+        if self._token_bucket and actual_tokens > estimated_tokens:
+            self._token_bucket.consume(actual_tokens - estimated_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return limiter counters"""
+        return {
+            "name": self.name,
+            "requests": self.total_requests,
+            "throttled": self.throttled_requests,
+            "wait_seconds": round(self.total_wait_time, 3),
+            "in_flight": self.in_flight,
+            "requests_per_minute": self.requests_per_minute,
+            "tokens_per_minute": self.tokens_per_minute,
+            "max_concurrency": self.max_concurrency,
+        }
@@ -0,0 +1,169 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Iterator, Optional, TypeVar
+
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+)
+from tenacity import (
+    AsyncRetrying,
+    RetryCallState,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+from app.logger import logger
+
+
+T = TypeVar("T")
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Classify an API error: only transient network/server failures are retried"""
+    if isinstance(
+        error,
+        (APITimeoutError, APIConnectionError, RateLimitError, InternalServerError),
+    ):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    """Return the server's Retry-After hint in seconds, if the error carries one"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(float(retry_after_ms) / 1000.0, 0.0)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        # HTTP-date form
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryBudget:
+    """
+    A shared allowance of retries, e.g. for one flow run.
+
+    Once exhausted, failing calls raise immediately instead of backing off, so a
+    degraded endpoint cannot stall every step of a flow for minutes.
+    """
+
+    def __init__(self, max_retries: int):
+        self.max_retries = max_retries
+        self.used = 0
+
+    @property
+    def remaining(self) -> int:
+        return max(self.max_retries - self.used, 0)
+
+    def try_consume(self) -> bool:
+        """Take one retry from the budget; False if none are left"""
+        if self.used >= self.max_retries:
+            return False
+        self.used += 1
+        return True
+
+    @contextmanager
+    def activate(self) -> Iterator["RetryBudget"]:
+        """Make this budget apply to all LLM calls made within the context"""
+        token = _current_budget.set(self)
+        try:
+            yield self
+        finally:
+            _current_budget.reset(token)
+
+
+_current_budget: ContextVar[Optional[RetryBudget]] = ContextVar(
+    "retry_budget", default=None
+)
+
+
+def get_current_budget() -> Optional[RetryBudget]:
+    """Return the retry budget active in the current context, if any"""
+    return _current_budget.get()
+
+
+class RetryPolicy:
+    """Retries a single API call on transient errors, honoring Retry-After hints"""
+
+    def __init__(
+        self,
+        max_attempts: int = 6,
+        min_wait: float = 1,
+        max_wait: float = 60,
+    ):
+        self.max_attempts = max_attempts
+        self.max_wait = max_wait
+        self._backoff = wait_random_exponential(min=min_wait, max=max_wait)
+        self.retries = 0
+        self.budget_exhausted = 0
+
+    def _should_retry(self, retry_state: RetryCallState) -> bool:
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        if error is None or not is_retryable(error):
+            return False
+        # The last attempt is never retried: do not spend the budget on it
+        if retry_state.attempt_number >= self.max_attempts:
+            return False
+        budget = get_current_budget()
+        if budget is not None and not budget.try_consume():
+            self.budget_exhausted += 1
+            logger.warning(f"Retry budget exhausted, not retrying: {error}")
+            return False
+        return True
+
+    def _wait(self, retry_state: RetryCallState) -> float:
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        retry_after = get_retry_after(error) if error else None
+        if retry_after is not None:
+            return min(retry_after, self.max_wait)
+        return self._backoff(retry_state)
+
+    def _before_sleep(self, retry_state: RetryCallState) -> None:
+        self.retries += 1
+        error = retry_state.outcome.exception()
+        logger.warning(
+            f"Retrying LLM call in {retry_state.next_action.sleep:.1f}s "
+            f"(attempt {retry_state.attempt_number}/{self.max_attempts}): {error}"
+        )
+
+    async def call(
+        self, func: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any
+    ) -> T:
+        """Await `func(*args, **kwargs)`, retrying it on retryable errors"""
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(self.max_attempts),
+            wait=self._wait,
+            retry=self._should_retry,
+            before_sleep=self._before_sleep,
+            reraise=True,
+        ):
+            with attempt:
+                return await func(*args, **kwargs)
@@ -1,8 +1,40 @@
-from enum import Enum
-from typing import Any, List, Literal, Optional, Union, Dict
-
-from pydantic import BaseModel, Field
 import base64
+import weakref
+from collections import deque
+from collections.abc import MutableSequence
+from enum import Enum
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    PrivateAttr,
+    field_serializer,
+    field_validator,
+    model_validator,
+)
+
+from app.blob_store import blob_store, is_blob_url
+from app.config import config
+from app.image_utils import (
+    BASE_IMAGE_TOKENS,
+    estimate_image_tokens,
+    prepare_image,
+    prepare_image_file,
+    probe_image_size,
+)
 
 class Role(str, Enum):
     """Message role options"""
@@ -61,6 +93,62 @@ class Message(BaseModel):
     name: Optional[str] = Field(default=None)
     tool_call_id: Optional[str] = Field(default=None)
 
+    # Token counts per tokenizer encoding, reset whenever a field is reassigned
+    _token_counts: Dict[str, int] = PrivateAttr(default_factory=dict)
+    # (images, bytes, tokens) no longer sent since older images were evicted
+    _image_savings: Tuple[int, int, int] = PrivateAttr(default=(0, 0, 0))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name in type(self).model_fields:
+            self.invalidate_token_count()
+
+    def get_token_count(self, encoding: str) -> Optional[int]:
+        """Return the cached token count for the given encoding, if any"""
+        return self._token_counts.get(encoding)
+
+    def set_token_count(self, encoding: str, tokens: int) -> None:
+        """Cache the token count computed with the given encoding"""
+        self._token_counts[encoding] = tokens
+
+    def invalidate_token_count(self) -> None:
+        """Drop cached token counts. Call this after mutating `content` in place."""
+        self._token_counts.clear()
+
+    def byte_size(self) -> int:
+        """Approximate size of the message's content, tool calls and ids in bytes"""
+        size = 0
+        if isinstance(self.content, str):
+            size += len(self.content.encode("utf-8"))
+        elif isinstance(self.content, list):
+            for item in self.content:
+                if not isinstance(item, dict):
+                    continue
+                if item.get("type") == "image_url":
+                    url = item.get("image_url", {}).get("url", "")
+                    blob = blob_store.get(url) if is_blob_url(url) else None
+                    # Data URLs are ASCII
+                    size += blob.nbytes if blob is not None else len(url)
+                else:
+                    size += len(str(item.get("text", "")).encode("utf-8"))
+        for tool_call in self.tool_calls or []:
+            size += len(tool_call.function.name) + len(
+                tool_call.function.arguments.encode("utf-8")
+            )
+        return size + len(self.name or "") + len(self.tool_call_id or "")
+
+    def blob_urls(self) -> Tuple[str, ...]:
+        """Blob URLs of the images in the message"""
+        if not isinstance(self.content, list):
+            return ()
+        urls = []
+        for item in self.content:
+            if isinstance(item, dict) and item.get("type") == "image_url":
+                url = item.get("image_url", {}).get("url")
+                if is_blob_url(url):
+                    urls.append(url)
+        return tuple(urls)
+
     def __add__(self, other) -> List["Message"]:
         """支持 Message + list 或 Message + Message 的操作"""
         if isinstance(other, list):
@@ -142,6 +230,8 @@ class Message(BaseModel):
         detail: str = "auto"
     ) -> "Message":
         """Create a user message with text and an image."""
+        # Data URLs are kept in the blob store, the message only references them
+        image_url = blob_store.put_data_url(image_url)
         content = [
             {"type": "text", "text": text},
             {
@@ -168,36 +258,306 @@ class Message(BaseModel):
         text: str,
         image_path: str,
         detail: str = "auto",
-        mime_type: str = "image/png"  
+        mime_type: str = "image/png",
+        roi: Optional[List[int]] = None,
     ) -> "Message":
-        """创建包含本地图片的消息（自动转为 base64）"""
-        # 读取图片并编码为 base64
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode("utf-8")
-        
+        """创建包含本地图片的消息（按 [image] 配置缩放/裁剪, 存入 blob store 并引用）"""
+        # 读取图片, 缩放到 tile 预算内并重新编码
+        image = prepare_image_file(
+            image_path, detail=detail, mime_type=mime_type, roi=roi
+        )
+        # 图片只存一份, 消息中只保留 blob URL, 发送请求时才展开为 data URL
+        image_url = blob_store.put(image.data, image.mime_type, image.size)
+
         # 构建符合 OpenAI 格式的内容
         content = [
             {"type": "text", "text": text},
             {
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:{mime_type};base64,{base64_image}",
+                    "url": image_url,
                     "detail": detail
                 }
             }
         ]
         return cls(role=Role.USER, content=content)
 
+class MessageBuffer(MutableSequence):
+    """
+    Message history backed by a deque, trimmed from the oldest end on every insert
+    (wherever the new message goes, the newest messages are the ones kept).
+
+    Appending and trimming are O(1). Slicing returns a list, and `list + buffer`
+    works, so the buffer can be passed wherever a list of messages is expected.
+    When trimming would leave tool results without the assistant message that
+    called them, those results are dropped too.
+
+    Images of the messages held are pinned in the blob store, so it never evicts
+    an image the history still references.
+    """
+
+    def __init__(
+        self,
+        messages: Iterable[Message] = (),
+        max_messages: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        self._messages: Deque[Message] = deque()
+        # Size of each message when it was added, in the same order
+        self._sizes: Deque[int] = deque()
+        # Blob URLs pinned by each message, in the same order
+        self._pins: Deque[Tuple[str, ...]] = deque()
+        weakref.finalize(self, _unpin_all, self._pins)
+        self.total_bytes = 0
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.trimmed = 0
+        self.extend(messages)
+
+    def set_limits(self, max_messages: Optional[int], max_bytes: Optional[int]) -> None:
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._trim()
+
+    def _over_limit(self) -> bool:
+        if self.max_messages is not None and len(self._messages) > self.max_messages:
+            return True
+        # The newest message is always kept, even if it alone exceeds max_bytes
+        return (
+            self.max_bytes is not None
+            and self.total_bytes > self.max_bytes
+            and len(self._messages) > 1
+        )
+
+    def _pop_oldest(self) -> None:
+        self._messages.popleft()
+        self.total_bytes -= self._sizes.popleft()
+        blob_store.unpin(self._pins.popleft())
+        self.trimmed += 1
+
+    def _trim(self) -> None:
+        if not self._over_limit():
+            return
+        while self._over_limit():
+            self._pop_oldest()
+        while len(self._messages) > 1 and self._messages[0].role == Role.TOOL:
+            self._pop_oldest()
+
+    def refresh_size(self, index: int) -> None:
+        """Recompute the size and pinned images of a message changed in place"""
+        message = self._messages[index]
+        size = message.byte_size()
+        self.total_bytes += size - self._sizes[index]
+        self._sizes[index] = size
+        self._repin(index, message.blob_urls())
+
+    def _repin(self, index: int, urls: Tuple[str, ...]) -> None:
+        # New images are pinned before old ones are released
+        blob_store.pin(urls)
+        blob_store.unpin(self._pins[index])
+        self._pins[index] = urls
+
+    def append(self, message: Message) -> None:
+        size = message.byte_size()
+        self._messages.append(message)
+        self._sizes.append(size)
+        self._pins.append(blob_store.pin(message.blob_urls()))
+        self.total_bytes += size
+        self._trim()
+
+    def extend(self, messages: Iterable[Message]) -> None:
+        for message in messages:
+            size = message.byte_size()
+            self._messages.append(message)
+            self._sizes.append(size)
+            self._pins.append(blob_store.pin(message.blob_urls()))
+            self.total_bytes += size
+        self._trim()
+
+    def _replace_all(self, messages: List[Message]) -> None:
+        # The new messages are pinned before the old ones are released
+        old_pins = list(self._pins)
+        self._messages.clear()
+        self._sizes.clear()
+        self._pins.clear()
+        self.total_bytes = 0
+        self.extend(messages)
+        for urls in old_pins:
+            blob_store.unpin(urls)
+
+    def __iadd__(self, messages: Iterable[Message]) -> "MessageBuffer":
+        self.extend(messages)
+        return self
+
+    def insert(self, index: int, message: Message) -> None:
+        """
+        Insert a message at `index`. Limits still trim the oldest messages, so on a
+        full buffer a message inserted at the front is dropped right away.
+        """
+        size = message.byte_size()
+        self._messages.insert(index, message)
+        self._sizes.insert(index, size)
+        self._pins.insert(index, blob_store.pin(message.blob_urls()))
+        self.total_bytes += size
+        self._trim()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self._messages)[index]
+        return self._messages[index]
+
+    def __setitem__(self, index, message: Message) -> None:
+        if isinstance(index, slice):
+            messages = list(self._messages)
+            messages[index] = message
+            self._replace_all(messages)
+            return
+        size = message.byte_size()
+        self.total_bytes += size - self._sizes[index]
+        self._messages[index] = message
+        self._sizes[index] = size
+        self._repin(index, message.blob_urls())
+        self._trim()
+
+    def __delitem__(self, index) -> None:
+        if isinstance(index, slice):
+            messages = list(self._messages)
+            del messages[index]
+            self._replace_all(messages)
+            return
+        self.total_bytes -= self._sizes[index]
+        del self._messages[index]
+        del self._sizes[index]
+        blob_store.unpin(self._pins[index])
+        del self._pins[index]
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self._messages)
+
+    def __reversed__(self) -> Iterator[Message]:
+        return reversed(self._messages)
+
+    def __add__(self, other: Iterable[Message]) -> List[Message]:
+        return list(self._messages) + list(other)
+
+    def __radd__(self, other: Iterable[Message]) -> List[Message]:
+        return list(other) + list(self._messages)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (MessageBuffer, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def clear(self) -> None:
+        self._messages.clear()
+        self._sizes.clear()
+        _unpin_all(self._pins)
+        self.total_bytes = 0
+
+    def __repr__(self) -> str:
+        return f"MessageBuffer({list(self._messages)!r})"
+
+
+def _unpin_all(pins: Deque[Tuple[str, ...]]) -> None:
+    """Release the images pinned by a buffer's messages (on clear or collection)"""
+    while pins:
+        blob_store.unpin(pins.popleft())
+
+
+EVICTED_IMAGE_MODES = ("low", "placeholder")
+EVICTED_IMAGE_PLACEHOLDER = "[earlier image removed]"
+
+
+class ImageEvictionReport(BaseModel):
+    """Images of a request's history sent reduced, and what that saves on the request"""
+
+    images_kept: int = 0
+    images_evicted: int = Field(0, description="Older images sent reduced in this request")
+    newly_evicted: int = Field(0, description="Images evicted for this request")
+    bytes_saved: int = Field(0, description="Image payload not sent in this request")
+    tokens_saved: int = Field(0, description="Image tokens not sent in this request")
+
+
+def _evict_image(item: Dict[str, Any], mode: str) -> Tuple[Dict[str, Any], int, int]:
+    """Reduced form of an image content item and the (bytes, tokens) it saves"""
+    image_url = item.get("image_url", {})
+    url = image_url.get("url", "")
+    detail = image_url.get("detail", "auto")
+    blob = blob_store.get(url) if is_blob_url(url) else None
+    data_url = blob.data_url if blob is not None else url
+    size = blob.size if blob is not None else None
+    data = None
+    if data_url.startswith("data:"):
+        data = blob.data if blob is not None else base64.b64decode(data_url.partition(",")[2])
+        size = size or probe_image_size(data)
+    tokens = estimate_image_tokens(*size, detail) if size else 0
+
+    if mode == "placeholder":
+        placeholder = {"type": "text", "text": EVICTED_IMAGE_PLACEHOLDER}
+        return placeholder, len(data_url) if data is not None else 0, tokens
+
+    if data is None:
+        # External URL: nothing to resize, the provider downsamples at low detail
+        return {**item, "image_url": {**image_url, "detail": "low"}}, 0, 0
+    # The model only sees 512px at low detail, so nothing more is uploaded
+    small = prepare_image(
+        data,
+        mime_type=blob.mime_type if blob is not None else None,
+        max_tiles=1,
+        jpeg_quality=config.image.jpeg_quality,
+        detail="low",
+    )
+    small_url = blob_store.put(small.data, small.mime_type, small.size)
+    saved_bytes = max(len(data_url) - blob_store.get(small_url).nbytes, 0)
+    low_item = {**item, "image_url": {**image_url, "url": small_url, "detail": "low"}}
+    return low_item, saved_bytes, max(tokens - BASE_IMAGE_TOKENS, 0)
+
+
 class Memory(BaseModel):
-    messages: List[Message] = Field(default_factory=list)
-    max_messages: int = Field(default=100)
+    messages: MessageBuffer = Field(default_factory=MessageBuffer)
+    max_messages: Optional[int] = Field(
+        default=100, description="Oldest messages are dropped beyond this count"
+    )
+    max_bytes: Optional[int] = Field(
+        default=None,
+        description="Oldest messages are dropped beyond this total size of content",
+    )
+    keep_last_images: Optional[int] = Field(
+        default_factory=lambda: config.image.keep_last_images,
+        description="Images kept at full detail, newest first (None keeps all)",
+    )
+    evicted_images: Literal[EVICTED_IMAGE_MODES] = Field(  # type: ignore
+        default_factory=lambda: config.image.evicted_images,
+        description="What older images become: low (512px, low detail) or placeholder",
+    )
+
+    model_config = ConfigDict(arbitrary_types_allowed=True, validate_assignment=True)
+
+    @field_validator("messages", mode="before")
+    @classmethod
+    def _to_buffer(cls, value: Any) -> MessageBuffer:
+        # Assigning a list (e.g. agent.messages = [...]) goes through the limits too
+        if isinstance(value, MessageBuffer):
+            return value
+        return MessageBuffer(
+            m if isinstance(m, Message) else Message.model_validate(m) for m in value
+        )
+
+    @field_serializer("messages")
+    def _serialize_messages(self, messages: MessageBuffer) -> List[Message]:
+        return list(messages)
+
+    @model_validator(mode="after")
+    def _apply_limits(self) -> "Memory":
+        self.messages.set_limits(self.max_messages, self.max_bytes)
+        return self
 
     def add_message(self, message: Message) -> None:
         """Add a message to memory"""
         self.messages.append(message)
-        # Optional: Implement message limit
-        if len(self.messages) > self.max_messages:
-            self.messages = self.messages[-self.max_messages :]
 
     def add_messages(self, messages: List[Message]) -> None:
         """Add multiple messages to memory"""
@@ -214,3 +574,55 @@ class Memory(BaseModel):
     def to_dict_list(self) -> List[dict]:
         """Convert messages to list of dicts"""
         return [msg.to_dict() for msg in self.messages]
+
+    @property
+    def total_bytes(self) -> int:
+        """Content size of the messages in memory"""
+        return self.messages.total_bytes
+
+    def evict_images(self) -> ImageEvictionReport:
+        """
+        Reduce images older than the `keep_last_images` newest ones, before a request.
+
+        Older images are downscaled to 512px and sent at low detail, or replaced by
+        a text placeholder. The report covers every reduced image still in memory,
+        since each saves its bytes and tokens on every request it is part of.
+        """
+        report = ImageEvictionReport()
+        if self.keep_last_images is None:
+            return report
+
+        seen = 0
+        for position in range(len(self.messages) - 1, -1, -1):
+            message = self.messages[position]
+            evicted, saved_bytes, saved_tokens = message._image_savings
+            if isinstance(message.content, list):
+                content = list(message.content)
+                for index in range(len(content) - 1, -1, -1):
+                    item = content[index]
+                    if not isinstance(item, dict) or item.get("type") != "image_url":
+                        continue
+                    seen += 1
+                    if seen <= self.keep_last_images:
+                        report.images_kept += 1
+                        continue
+                    if item.get("image_url", {}).get("detail") == "low":
+                        # Already evicted (or sent at low detail from the start)
+                        continue
+                    content[index], item_bytes, item_tokens = _evict_image(
+                        item, self.evicted_images
+                    )
+                    evicted += 1
+                    saved_bytes += item_bytes
+                    saved_tokens += item_tokens
+                    report.newly_evicted += 1
+                if evicted != message._image_savings[0]:
+                    message.content = content
+                    message._image_savings = (evicted, saved_bytes, saved_tokens)
+                    # Keep max_bytes accounting in line with what is sent now
+                    self.messages.refresh_size(position)
+
+            report.images_evicted += evicted
+            report.bytes_saved += saved_bytes
+            report.tokens_saved += saved_tokens
+        return report
@@ -0,0 +1,206 @@
+import json
+from typing import Any, Dict, List, Optional
+
+from openai.types.chat import ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
+from pydantic import BaseModel, Field
+
+
+class ToolArgumentEvent(BaseModel):
+    """A tool call argument that finished streaming"""
+
+    tool_call_index: int = Field(
+        ..., description="Index of the tool call in the response"
+    )
+    tool_name: Optional[str] = Field(None, description="Name of the called tool")
+    key: str = Field(..., description="Top-level argument name")
+    index: Optional[int] = Field(
+        None, description="Element index when the argument is an array, else None"
+    )
+    value: Any = Field(None, description="Parsed JSON value")
+
+    @property
+    def path(self) -> str:
+        """Argument path, e.g. `steps[0]` or `title`"""
+        return f"{self.key}[{self.index}]" if self.index is not None else self.key
+
+
+class IncrementalArgumentsParser:
+    """
+    Incrementally scans a streamed JSON object of tool arguments.
+
+    Each call to `feed` only scans the new characters and returns the
+    (key, index, value) triples completed by them: top-level fields once their
+    value is closed, and elements of top-level arrays as soon as each element is
+    closed, so `steps[0]` is available before the rest of `steps` is generated.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key_start: Optional[int] = None
+        self._key: Optional[str] = None
+        self._value_start: Optional[int] = None
+        self._in_array = False
+        self._item_start: Optional[int] = None
+        self._item_index = 0
+
+    @staticmethod
+    def _parse(text: str) -> Any:
+        text = text.strip()
+        if not text:
+            raise ValueError("empty value")
+        return json.loads(text)
+
+    def _emit(self, events: List[tuple], text: str, index: Optional[int]) -> None:
+        try:
+            events.append((self._key, index, self._parse(text)))
+        except ValueError:
+            # Malformed fragments are left for the final json.loads to report
+            pass
+
+    def feed(self, text: str) -> List[tuple]:
+        """Append streamed text and return the (key, index, value) triples it completed"""
+        events: List[tuple] = []
+        self.buffer += text
+        buf = self.buffer
+
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        self._key = json.loads(buf[self._key_start : i + 1])
+                        self._key_start = None
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_start = i
+                    self._expect_key = False
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._expect_key = ch == "{"
+                elif (
+                    self._depth == 2
+                    and ch == "["
+                    and self._value_start is not None
+                    and not buf[self._value_start : i].strip()
+                ):
+                    # The current top-level value is an array: track its elements
+                    self._in_array = True
+                    self._item_start = i + 1
+                    self._item_index = 0
+            elif ch in "}]":
+                if self._depth == 2 and self._in_array and ch == "]":
+                    if buf[self._item_start : i].strip():
+                        self._emit(events, buf[self._item_start : i], self._item_index)
+                    self._in_array = False
+                elif self._depth == 1 and self._value_start is not None:
+                    self._emit(events, buf[self._value_start : i], None)
+                    self._value_start = None
+                self._depth -= 1
+            elif ch == ":" and self._depth == 1:
+                self._value_start = i + 1
+            elif ch == ",":
+                if self._depth == 1 and self._value_start is not None:
+                    self._emit(events, buf[self._value_start : i], None)
+                    self._value_start = None
+                    self._expect_key = True
+                elif self._depth == 2 and self._in_array:
+                    self._emit(events, buf[self._item_start : i], self._item_index)
+                    self._item_start = i + 1
+                    self._item_index += 1
+
+        self._pos = len(buf)
+        return events
+
+
+class ToolCallStreamAccumulator:
+    """Reassembles streamed `tool_calls` deltas and reports completed arguments"""
+
+    def __init__(self):
+        self._calls: Dict[int, Dict[str, Any]] = {}
+
+    def add_deltas(self, deltas: Optional[List[Any]]) -> List[ToolArgumentEvent]:
+        """Merge the tool call deltas of one chunk; return newly completed arguments"""
+        events: List[ToolArgumentEvent] = []
+        for delta in deltas or []:
+            call = self._calls.setdefault(
+                delta.index,
+                {
+                    "id": None,
+                    "name": None,
+                    "parser": IncrementalArgumentsParser(),
+                },
+            )
+            if delta.id:
+                call["id"] = delta.id
+            function = delta.function
+            if function is None:
+                continue
+            if function.name:
+                call["name"] = (call["name"] or "") + function.name
+            if function.arguments:
+                for key, index, value in call["parser"].feed(function.arguments):
+                    events.append(
+                        ToolArgumentEvent(
+                            tool_call_index=delta.index,
+                            tool_name=call["name"],
+                            key=key,
+                            index=index,
+                            value=value,
+                        )
+                    )
+        return events
+
+    def to_tool_calls(self) -> List[ChatCompletionMessageToolCall]:
+        """Return the complete tool calls in index order"""
+        return [
+            ChatCompletionMessageToolCall(
+                id=call["id"] or f"call_{index}",
+                type="function",
+                function=Function(
+                    name=call["name"] or "", arguments=call["parser"].buffer
+                ),
+            )
+            for index, call in sorted(self._calls.items())
+        ]
+
+
+class StreamEvent(BaseModel):
+    """A text delta (or the final summary) of a streamed `LLM.ask_stream` response"""
+
+    delta: str = Field("", description="Text generated since the previous event")
+    index: int = Field(0, description="Sequence number of the delta")
+    done: bool = Field(False, description="True for the final event of the stream")
+    text: Optional[str] = Field(
+        None, description="Full response, set on the final event"
+    )
+    elapsed: float = Field(0.0, description="Seconds since the request was sent")
+    time_to_first_token: Optional[float] = Field(
+        None, description="Seconds until the first delta arrived"
+    )
+    usage: Optional[Dict[str, int]] = Field(
+        None, description="Token usage, set on the final event"
+    )
+    cached: bool = Field(False, description="True if served from the response cache")
+
+
+def console_echo(event: StreamEvent) -> None:
+    """Stream handler printing deltas to stdout"""
+    if event.done:
+        print()  # Newline after streaming
+    else:
+        print(event.delta, end="", flush=True)
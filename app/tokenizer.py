@@ -0,0 +1,240 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional
+
+import tiktoken
+from tiktoken.load import load_tiktoken_bpe
+
+from app.batch import percentile
+from app.logger import logger
+
+
+DEFAULT_ENCODING = "cl100k_base"
+
+TOKEN_COUNTING_MODES = ("exact", "estimate")
+
+_ENDOFTEXT = "<|endoftext|>"
+_ENDOFPROMPT = "<|endofprompt|>"
+
+# Split patterns and special tokens of the encodings used by chat models, so they
+# can be built from a local .tiktoken file (same values as tiktoken_ext.openai_public)
+_ENCODING_SPECS: Dict[str, Dict[str, Any]] = {
+    "cl100k_base": {
+        "pat_str": r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}++|\p{N}{1,3}+| ?[^\s\p{L}\p{N}]++[\r\n]*+|\s++$|\s*[\r\n]|\s+(?!\S)|\s""",
+        "special_tokens": {
+            _ENDOFTEXT: 100257,
+            "<|fim_prefix|>": 100258,
+            "<|fim_middle|>": 100259,
+            "<|fim_suffix|>": 100260,
+            _ENDOFPROMPT: 100276,
+        },
+    },
+    "o200k_base": {
+        "pat_str": "|".join(
+            [
+                r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]*[\p{Ll}\p{Lm}\p{Lo}\p{M}]+(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+                r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]+[\p{Ll}\p{Lm}\p{Lo}\p{M}]*(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+                r"""\p{N}{1,3}""",
+                r""" ?[^\s\p{L}\p{N}]+[\r\n/]*""",
+                r"""\s*[\r\n]+""",
+                r"""\s+(?!\S)""",
+                r"""\s+""",
+            ]
+        ),
+        "special_tokens": {_ENDOFTEXT: 199999, _ENDOFPROMPT: 200018},
+    },
+}
+
+# One encoding per name for the whole process
+_encodings: Dict[str, tiktoken.Encoding] = {}
+_encodings_lock = threading.Lock()
+
+
+def encoding_name_for_model(model: str) -> str:
+    """Encoding used by `model` (cl100k_base for models tiktoken does not know)"""
+    try:
+        return tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        return DEFAULT_ENCODING
+
+
+def _find_local_file(name: str, tokenizer_path: Optional[str]) -> Optional[Path]:
+    """Look for `<name>.tiktoken` at the configured path or in TIKTOKEN_CACHE_DIR"""
+    candidates: List[Path] = []
+    if tokenizer_path:
+        path = Path(tokenizer_path).expanduser()
+        candidates.append(path if path.is_file() else path / f"{name}.tiktoken")
+    cache_dir = os.environ.get("TIKTOKEN_CACHE_DIR")
+    if cache_dir:
+        candidates.append(Path(cache_dir) / f"{name}.tiktoken")
+    for candidate in candidates:
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def _load_encoding(name: str, tokenizer_path: Optional[str]) -> tiktoken.Encoding:
+    local_file = _find_local_file(name, tokenizer_path)
+    if local_file is not None and name in _ENCODING_SPECS:
+        spec = _ENCODING_SPECS[name]
+        return tiktoken.Encoding(
+            name=name,
+            pat_str=spec["pat_str"],
+            mergeable_ranks=load_tiktoken_bpe(str(local_file)),
+            special_tokens=spec["special_tokens"],
+        )
+    if local_file is not None:
+        logger.warning(
+            f"No local loader for encoding '{name}', ignoring {local_file} "
+            "(use TIKTOKEN_CACHE_DIR with tiktoken's cache layout instead)"
+        )
+    # tiktoken's own loader: reads its cache (TIKTOKEN_CACHE_DIR) or downloads
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        raise RuntimeError(
+            f"Could not load tokenizer encoding '{name}': {e}. For offline use, set "
+            f"tokenizer_path in [llm] or TIKTOKEN_CACHE_DIR to a directory containing "
+            f"{name}.tiktoken"
+        ) from e
+
+
+def get_encoding(name: str, tokenizer_path: Optional[str] = None) -> tiktoken.Encoding:
+    """Load an encoding once per process; later calls return the shared instance"""
+    encoding = _encodings.get(name)
+    if encoding is not None:
+        return encoding
+    with _encodings_lock:
+        encoding = _encodings.get(name)
+        if encoding is None:
+            started = time.perf_counter()
+            encoding = _load_encoding(name, tokenizer_path)
+            _encodings[name] = encoding
+            logger.debug(
+                f"Loaded tokenizer '{name}' in {time.perf_counter() - started:.2f}s"
+            )
+    return encoding
+
+
+class LazyEncoding:
+    """
+    Stand-in for a tiktoken encoding that is loaded on first use.
+
+    `name` is known without loading, so it can key token count caches.
+    """
+
+    def __init__(self, name: str, tokenizer_path: Optional[str] = None):
+        self.name = name
+        self.tokenizer_path = tokenizer_path
+
+    @property
+    def loaded(self) -> bool:
+        return self.name in _encodings
+
+    @property
+    def encoding(self) -> tiktoken.Encoding:
+        return get_encoding(self.name, self.tokenizer_path)
+
+    def encode(self, text: str, **kwargs: Any) -> List[int]:
+        return self.encoding.encode(text, **kwargs)
+
+    def decode(self, tokens: List[int], **kwargs: Any) -> str:
+        return self.encoding.decode(tokens, **kwargs)
+
+    def __getattr__(self, attr: str) -> Any:
+        # Dunders (copy/pickle probes) and our own fields missing on a half-built
+        # instance must not load the encoding or recurse into it
+        if attr.startswith("__") or attr in ("name", "tokenizer_path"):
+            raise AttributeError(attr)
+        # Anything else (encode_batch, n_vocab, ...) comes from the real encoding
+        return getattr(self.encoding, attr)
+
+
+class TokenCountErrors:
+    """
+    Relative error of local input token counts against the `usage.prompt_tokens`
+    reported by the API, for a report and a safety margin on budget checks.
+    """
+
+    def __init__(
+        self,
+        max_samples: int = 200,
+        min_samples: int = 10,
+        default_margin: float = 0.15,
+    ):
+        self.min_samples = min_samples
+        self.default_margin = default_margin
+        self._errors: Deque[float] = deque(maxlen=max_samples)
+
+    def record(self, counted: int, actual: int) -> None:
+        if counted > 0 and actual > 0:
+            self._errors.append((counted - actual) / actual)
+
+    def margin(self) -> float:
+        """Relative overcount needed to cover 95% of observed undercounts"""
+        if len(self._errors) < self.min_samples:
+            return self.default_margin
+        undercounts = [max(-error, 0.0) for error in self._errors]
+        return percentile(undercounts, 95)
+
+    def upper_bound(self, tokens: int) -> int:
+        return math.ceil(tokens * (1 + self.margin()))
+
+    def report(self) -> Dict[str, Any]:
+        errors = list(self._errors)
+        if not errors:
+            return {"samples": 0}
+        abs_errors = [abs(error) for error in errors]
+        return {
+            "samples": len(errors),
+            "bias": round(sum(errors) / len(errors), 4),
+            "mean_abs_error": round(sum(abs_errors) / len(errors), 4),
+            "p50_abs_error": round(percentile(abs_errors, 50), 4),
+            "p95_abs_error": round(percentile(abs_errors, 95), 4),
+            "max_abs_error": round(max(abs_errors), 4),
+            "budget_margin": round(self.margin(), 4),
+        }
+
+
+class TokenEstimator:
+    """
+    Tokenizer-free token count from text length, calibrated against the prompt
+    token counts the API reports.
+
+    ASCII text averages about 4 characters per token; other characters (CJK,
+    accented, emoji) about one token each. A correction factor is then nudged
+    towards `actual / estimated` after every response.
+    """
+
+    name = "estimate"
+
+    def __init__(self, chars_per_token: float = 4.0, alpha: float = 0.2):
+        self.chars_per_token = chars_per_token
+        self.alpha = alpha
+        self.factor = 1.0
+        self.calibrations = 0
+
+    @property
+    def cache_key(self) -> str:
+        """Key for per-message count caches; changes when the calibration moves"""
+        return f"{self.name}@{self.factor:.2f}"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        chars = len(text)
+        # Non-ASCII characters take 2-4 bytes in UTF-8, mostly 3 (CJK)
+        non_ascii = (len(text.encode("utf-8")) - chars) / 2
+        tokens = (chars - non_ascii) / self.chars_per_token + non_ascii
+        return max(1, round(tokens * self.factor))
+
+    def calibrate(self, estimated: int, actual: int) -> None:
+        if estimated <= 0 or actual <= 0:
+            return
+        ratio = actual / estimated
+        self.factor = min(max(self.factor * ratio**self.alpha, 0.25), 4.0)
+        self.calibrations += 1
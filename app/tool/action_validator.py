@@ -1,10 +1,12 @@
 from pydantic import Field
+from app.blob_store import blob_store
 from app.exceptions import ToolError
+from app.image_utils import prepare_image_file
 from app.tool.base import BaseTool, ToolResult
 from app.schema import Message
 from app.llm import LLM
+from app.usage import usage_context
 import json
-import base64
 import os
 from mimetypes import guess_type
 
@@ -32,10 +34,10 @@ class ActionValidator(BaseTool):
         "required": ["status"],
         "additionalProperties": False
     }
-    llm: LLM = Field(default_factory=lambda: LLM())
+    llm: LLM = Field(default_factory=lambda: LLM.for_role("action_validator"))
 
     async def execute(self, action: str, initial_state_path: str, post_action_path: str) -> ToolResult:
-        def load_image_as_base64(image_path: str) -> tuple:
+        def load_image_as_blob_url(image_path: str) -> str:
             if not os.path.exists(image_path):
                 raise ToolError(f"Image file not found: {image_path}")
             
@@ -43,14 +45,12 @@ class ActionValidator(BaseTool):
             if mime_type not in ["image/png", "image/jpeg"]:
                 raise ToolError(f"Unsupported image format: {mime_type}")
             
-            with open(image_path, "rb") as image_file:
-                return (
-                    base64.b64encode(image_file.read()).decode("utf-8"),
-                    mime_type or "image/jpeg"
-                )
+            # Resized to the [image] tile budget and re-encoded before upload
+            image = prepare_image_file(image_path, detail="high")
+            return blob_store.put(image.data, image.mime_type, image.size)
         try:
-            init_b64, init_mime = load_image_as_base64(initial_state_path)
-            post_b64, post_mime = load_image_as_base64(post_action_path)
+            init_url = load_image_as_blob_url(initial_state_path)
+            post_url = load_image_as_blob_url(post_action_path)
         except ToolError as e:
             return ToolResult(output=False, error=str(e))
 
@@ -74,14 +74,14 @@ class ActionValidator(BaseTool):
             {
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:{init_mime};base64,{init_b64}",
+                    "url": init_url,
                     "detail": "high"
                 }
             },
             {
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:{post_mime};base64,{post_b64}",
+                    "url": post_url,
                     "detail": "high"
                 }
             }
@@ -93,12 +93,13 @@ class ActionValidator(BaseTool):
         )
 
         try:
-            response = await self.llm.ask_tool(
-                messages=[user_msg],
-                system_msgs=[system_msg],
-                tools=[self.to_param()],
-                tool_choice="auto"
-            )
+            with usage_context(caller="action_validator"):
+                response = await self.llm.ask_tool(
+                    messages=[user_msg],
+                    system_msgs=[system_msg],
+                    tools=[self.to_param()],
+                    tool_choice="auto"
+                )
         except Exception as e:
             raise ToolError(f"LLM API error: {str(e)}")
 
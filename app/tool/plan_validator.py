@@ -4,6 +4,7 @@ from app.exceptions import ToolError
 from app.tool.base import BaseTool, ToolResult
 from app.schema import Message
 from app.llm import LLM
+from app.usage import usage_context
 import json
 
 class PlanValidator(BaseTool):
@@ -26,18 +27,19 @@ class PlanValidator(BaseTool):
         "required": ["status"],
         "additionalProperties": False
     }
-    llm: LLM = Field(default_factory=lambda: LLM())
+    llm: LLM = Field(default_factory=lambda: LLM.for_role("plan_validator"))
 
     async def execute(self,task: str, plans: str) -> ToolResult:     
         user_msg = f"""## Task\n{task}## Action plan sequence\n{plans}"""
         user_msg = Message.user_message(user_msg)
         system_msg = Message.system_message("You are an agent skilled in making independent judgments based on input requirements.")
-        response = await self.llm.ask_tool(
-            messages=[user_msg],
-            system_msgs=[system_msg],
-            tools=[self.to_param()],
-            tool_choice="auto"
-        )
+        with usage_context(caller="plan_validator"):
+            response = await self.llm.ask_tool(
+                messages=[user_msg],
+                system_msgs=[system_msg],
+                tools=[self.to_param()],
+                tool_choice="auto"
+            )
         if response.tool_calls:
             for tool_call in response.tool_calls:
                 # Parse the arguments
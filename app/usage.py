@@ -0,0 +1,188 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Union
+
+from pydantic import BaseModel, Field
+
+from app.batch import percentile
+
+
+DEFAULT_CALLER = "default"
+
+_current_caller: ContextVar[str] = ContextVar("llm_caller", default=DEFAULT_CALLER)
+_current_flow: ContextVar[Optional[str]] = ContextVar("llm_flow", default=None)
+# Calls recorded within `collect_usage`, in addition to the ledger
+_current_collector: ContextVar[Optional[List["UsageRecord"]]] = ContextVar(
+    "llm_usage_collector", default=None
+)
+
+
+@contextmanager
+def usage_context(
+    caller: Optional[str] = None, flow_id: Optional[str] = None
+) -> Iterator[None]:
+    """Attribute all LLM calls made within the context to a caller tag and/or flow"""
+    caller_token = _current_caller.set(caller) if caller is not None else None
+    flow_token = _current_flow.set(flow_id) if flow_id is not None else None
+    try:
+        yield
+    finally:
+        if flow_token is not None:
+            _current_flow.reset(flow_token)
+        if caller_token is not None:
+            _current_caller.reset(caller_token)
+
+
+@contextmanager
+def collect_usage() -> Iterator[List["UsageRecord"]]:
+    """Collect the records of the LLM calls made within the context (e.g. one batch item)"""
+    records: List[UsageRecord] = []
+    token = _current_collector.set(records)
+    try:
+        yield records
+    finally:
+        _current_collector.reset(token)
+
+
+def get_current_caller() -> str:
+    return _current_caller.get()
+
+
+def get_current_flow() -> Optional[str]:
+    return _current_flow.get()
+
+
+class UsageRecord(BaseModel):
+    """Usage of a single LLM call"""
+
+    timestamp: float = Field(default_factory=time.time)
+    config_name: str
+    model: str
+    method: str = Field(..., description="ask, ask_stream, ask_tool or ask_tool_stream")
+    caller: str = Field(DEFAULT_CALLER, description="Component that made the call")
+    flow_id: Optional[str] = Field(None, description="Flow run the call belongs to")
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    latency: float = Field(0.0, description="Wall time of the call in seconds")
+    time_to_first_token: Optional[float] = None
+    response_cached: bool = Field(False, description="Served from the response cache")
+    hedged: bool = Field(False, description="A duplicate request was sent")
+    hedge_won: bool = Field(False, description="The duplicate request answered first")
+    error: Optional[str] = None
+
+
+class UsageLedger:
+    """Process-wide record of LLM calls with per-caller, per-flow and total rollups"""
+
+    def __init__(self, max_records: int = 100000):
+        self._records: Deque[UsageRecord] = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def record(self, record: UsageRecord) -> None:
+        with self._lock:
+            self._records.append(record)
+        collector = _current_collector.get()
+        if collector is not None:
+            collector.append(record)
+
+    def records(
+        self, flow_id: Optional[str] = None, caller: Optional[str] = None
+    ) -> List[UsageRecord]:
+        """Return recorded calls, optionally filtered by flow and/or caller"""
+        with self._lock:
+            records = list(self._records)
+        return [
+            r
+            for r in records
+            if (flow_id is None or r.flow_id == flow_id)
+            and (caller is None or r.caller == caller)
+        ]
+
+    @staticmethod
+    def _aggregate(records: List[UsageRecord]) -> Dict[str, Any]:
+        latencies = [r.latency for r in records if r.error is None]
+        ttfts = [
+            r.time_to_first_token
+            for r in records
+            if r.error is None and r.time_to_first_token is not None
+        ]
+        prompt_tokens = sum(r.prompt_tokens for r in records)
+        cached_tokens = sum(r.cached_tokens for r in records)
+        return {
+            "calls": len(records),
+            "errors": sum(1 for r in records if r.error is not None),
+            "response_cache_hits": sum(1 for r in records if r.response_cached),
+            "hedged": sum(1 for r in records if r.hedged),
+            "hedge_wins": sum(1 for r in records if r.hedge_won),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": sum(r.completion_tokens for r in records),
+            "cached_tokens": cached_tokens,
+            "prompt_cache_ratio": (
+                round(cached_tokens / prompt_tokens, 4) if prompt_tokens else 0.0
+            ),
+            "latency_total": round(sum(latencies), 3),
+            "latency_mean": round(sum(latencies) / len(latencies), 3)
+            if latencies
+            else 0.0,
+            "latency_p50": round(percentile(latencies, 50), 3),
+            "latency_p95": round(percentile(latencies, 95), 3),
+            "ttft_mean": round(sum(ttfts) / len(ttfts), 3) if ttfts else 0.0,
+        }
+
+    def rollup(
+        self, flow_id: Optional[str] = None, group_by: Optional[str] = "caller"
+    ) -> Dict[str, Any]:
+        """
+        Aggregate usage, optionally for a single flow.
+
+        Args:
+            flow_id: Only include calls made by this flow run (None for all calls)
+            group_by: Record field to break the totals down by (e.g. "caller",
+                "model", "flow_id"), or None for totals only
+
+        Returns:
+            {"total": {...}, "by_<group_by>": {value: {...}}}
+        """
+        records = self.records(flow_id=flow_id)
+        result: Dict[str, Any] = {"total": self._aggregate(records)}
+        if group_by:
+            groups: Dict[str, List[UsageRecord]] = {}
+            for r in records:
+                groups.setdefault(str(getattr(r, group_by)), []).append(r)
+            result[f"by_{group_by}"] = {
+                key: self._aggregate(group) for key, group in sorted(groups.items())
+            }
+        return result
+
+    def to_dict(self, include_records: bool = False) -> Dict[str, Any]:
+        """Process-wide rollups by caller, model and flow"""
+        data = {
+            **self.rollup(group_by="caller"),
+            "by_model": self.rollup(group_by="model")["by_model"],
+            "by_flow": self.rollup(group_by="flow_id")["by_flow_id"],
+        }
+        if include_records:
+            data["records"] = [r.model_dump() for r in self.records()]
+        return data
+
+    def dump_json(self, path: Union[str, Path], include_records: bool = True) -> None:
+        """Write the rollups (and optionally every record) to a JSON file"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(
+            json.dumps(self.to_dict(include_records), indent=2, ensure_ascii=False),
+            encoding="utf-8",
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+
+usage_ledger = UsageLedger()
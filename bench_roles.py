@@ -0,0 +1,202 @@
+"""
+Benchmark end-to-end PlanningFlow latency under different [roles] maps.
+
+Runs offline: every LLM config is served by a FakeBackend that answers each
+component with a canned response after the config's simulated latency, so the
+difference between role maps is the time saved by routing roles to faster
+configs.
+
+Usage:
+    python bench_roles.py
+    python bench_roles.py --latency default=2.0 --latency fast=0.3 \
+        --roles "" --roles "plan_validator=fast" --roles "plan_validator=fast,lerobot=fast"
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from app.agent.lerobot import Lerobot
+from app.batch import percentile
+from app.config import config
+from app.flow.base import FlowType
+from app.flow.flow_factory import FlowFactory
+from app.llm import LLM
+from app.llm_backend import FakeBackend
+from app.logger import logger
+from app.usage import usage_ledger
+
+
+def respond(params: Dict[str, Any]) -> Any:
+    """Canned answer for whichever component sent the request"""
+    tools = {tool["function"]["name"] for tool in params.get("tools") or []}
+    if "action_planning" in tools:
+        arguments = {"plan_id": "bench", "title": "Benchmark plan", "steps": [1, 2]}
+        return {
+            "tool_calls": [
+                {"function": {"name": "action_planning", "arguments": arguments}}
+            ]
+        }
+    if "validate_plan" in tools:
+        arguments = {"status": "plan_generated_successfully"}
+        return {
+            "tool_calls": [
+                {"function": {"name": "validate_plan", "arguments": arguments}}
+            ]
+        }
+    if "validate_robotic_action" in tools:
+        arguments = {"status": "action_execute_successfully"}
+        return {
+            "tool_calls": [
+                {
+                    "function": {
+                        "name": "validate_robotic_action",
+                        "arguments": arguments,
+                    }
+                }
+            ]
+        }
+    # Agent steps and the final summary: plain text, so no robot action is executed
+    return "Step completed."
+
+
+def parse_pairs(text: str) -> Dict[str, str]:
+    """Parse "a=x,b=y" into {"a": "x", "b": "y"}"""
+    pairs = [item.split("=", 1) for item in text.split(",") if item.strip()]
+    return {key.strip(): value.strip() for key, value in pairs}
+
+
+# Results PlanningFlow returns instead of raising when a run fails
+FAILED_RESULT_PREFIXES = (
+    "Execution failed:",
+    "Failed to create plan",
+    "Error executing step",
+)
+
+
+def run_failure(result: str, flow_id: str) -> Optional[str]:
+    """Why a flow run failed (None if it succeeded): its result or a failed LLM call"""
+    for line in (result or "").splitlines():
+        if line.startswith(FAILED_RESULT_PREFIXES):
+            return line
+    errors = [r.error for r in usage_ledger.records(flow_id=flow_id) if r.error]
+    if errors:
+        return f"{len(errors)} LLM call(s) failed, first: {errors[0]}"
+    return None
+
+
+async def run_scenario(
+    role_map: Dict[str, str], latencies: Dict[str, float], runs: int
+) -> Dict[str, Any]:
+    # Components resolve their LLM config at construction time
+    config.roles.clear()
+    config.roles.update(role_map)
+    for name, latency in latencies.items():
+        LLM(name).set_backend(FakeBackend(default=respond, latency=latency))
+
+    label = ",".join(f"{k}={v}" for k, v in role_map.items()) or "all default"
+    wall_times: List[float] = []
+    flow_ids: List[str] = []
+    for run in range(runs):
+        flow = FlowFactory.create_flow(
+            flow_type=FlowType.PLANNING, agents={"lerobot": Lerobot()}
+        )
+        flow.active_plan_id = f"bench_{len(usage_ledger.records())}_{run}"
+        flow_ids.append(flow.active_plan_id)
+        started = time.perf_counter()
+        result = await flow.execute("Put the apple in the refrigerator")
+        elapsed = time.perf_counter() - started
+        # The wall time of a failed run says nothing about the role map
+        failure = run_failure(result, flow.active_plan_id)
+        if failure:
+            raise RuntimeError(f"Run {run + 1} with roles [{label}] failed: {failure}")
+        wall_times.append(elapsed)
+
+    by_caller: Dict[str, float] = {}
+    calls = 0
+    for flow_id in flow_ids:
+        usage = usage_ledger.rollup(flow_id=flow_id)
+        calls += usage["total"]["calls"]
+        for caller, stats in usage["by_caller"].items():
+            by_caller[caller] = (
+                by_caller.get(caller, 0.0) + stats["latency_total"] / runs
+            )
+
+    return {
+        "roles": label,
+        "runs": runs,
+        "llm_calls_per_run": calls / runs,
+        "wall_mean": round(sum(wall_times) / runs, 3),
+        "wall_p50": round(percentile(wall_times, 50), 3),
+        "wall_p95": round(percentile(wall_times, 95), 3),
+        "llm_seconds_by_caller": {k: round(v, 3) for k, v in sorted(by_caller.items())},
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--latency",
+        action="append",
+        default=[],
+        help="Simulated latency of an LLM config, e.g. fast=0.3 (repeatable)",
+    )
+    parser.add_argument(
+        "--roles",
+        action="append",
+        default=None,
+        help='Role map to benchmark, e.g. "plan_validator=fast,lerobot=fast" (repeatable)',
+    )
+    parser.add_argument("--runs", type=int, default=3, help="Flow runs per role map")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    latencies = {"default": 2.0, "fast": 0.3}
+    latencies.update(
+        {k: float(v) for k, v in parse_pairs(",".join(args.latency)).items()}
+    )
+    scenarios = (
+        [parse_pairs(r) for r in args.roles]
+        if args.roles
+        else [
+            {},
+            {"plan_validator": "fast", "action_validator": "fast"},
+            {"plan_validator": "fast", "action_validator": "fast", "lerobot": "fast"},
+        ]
+    )
+    for role_map in scenarios:
+        missing = set(role_map.values()) - set(latencies)
+        if missing:
+            parser.error(
+                f"No --latency given for configs: {', '.join(sorted(missing))}"
+            )
+
+    results = []
+    for role_map in scenarios:
+        try:
+            result = await run_scenario(role_map, latencies, args.runs)
+        except RuntimeError as e:
+            logger.error(f"Benchmark aborted: {e}")
+            raise SystemExit(1)
+        results.append(result)
+        logger.info(
+            f"[{result['roles']}] wall mean {result['wall_mean']:.2f}s, "
+            f"p95 {result['wall_p95']:.2f}s, {result['llm_calls_per_run']:.0f} LLM calls/run, "
+            f"LLM time by caller: {result['llm_seconds_by_caller']}"
+        )
+
+    print(f"\n{'roles':<60} {'mean':>8} {'p50':>8} {'p95':>8}")
+    for result in results:
+        print(
+            f"{result['roles']:<60} {result['wall_mean']:>7.2f}s "
+            f"{result['wall_p50']:>7.2f}s {result['wall_p95']:>7.2f}s"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"latencies": latencies, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+"""
+Benchmark input token counting: CPU time and error of the "exact" (tokenizer) and
+"estimate" (calibrated length heuristic) modes.
+
+Runs on cassettes of real flows, recorded with `backend = "record"` in [llm]: the
+recorded requests are counted in both modes and compared with the prompt_tokens
+the API reported for them. The estimate is calibrated online, in recording order,
+the same way it is during a run.
+
+Usage:
+    python bench_tokens.py workspace/llm_cassette.jsonl
+    python bench_tokens.py flow1.jsonl flow2.jsonl --repeat 20 --output tokens.json
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.llm import LLM
+from app.logger import logger
+from app.tokenizer import TOKEN_COUNTING_MODES
+
+
+def prompt_tokens(entry: Dict[str, Any]) -> Optional[int]:
+    """prompt_tokens reported for a recorded request (None if not reported)"""
+    usage = (entry.get("response") or {}).get("usage")
+    for chunk in entry.get("chunks") or []:
+        # Streams only report usage in a final chunk, with stream_options
+        usage = chunk.get("usage") or usage
+    return usage.get("prompt_tokens") if usage else None
+
+
+def load_requests(paths: List[str]) -> List[Tuple[List[dict], List[dict], int]]:
+    """(messages, tools, prompt_tokens) of every recorded request with usage"""
+    requests = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                actual = prompt_tokens(entry)
+                if actual:
+                    request = entry["request"]
+                    requests.append(
+                        (request["messages"], request.get("tools") or [], actual)
+                    )
+    return requests
+
+
+def count_request(llm: LLM, messages: List[dict], tools: List[dict]) -> int:
+    return llm.count_message_tokens(messages) + sum(
+        llm.count_tool_tokens(tool) for tool in tools
+    )
+
+
+def run_mode(
+    llm: LLM, mode: str, requests: List[Tuple[List[dict], List[dict], int]], repeat: int
+) -> Dict[str, Any]:
+    llm.set_token_counting(mode)
+    # Load the tokenizer outside the measurement
+    llm.count_tokens("warm up")
+
+    # Error, with the estimate calibrated in recording order as during a run
+    for messages, tools, actual in requests:
+        llm._tool_token_cache.clear()
+        llm.calibrate_token_count(count_request(llm, messages, tools), actual)
+    error = llm.get_token_count_error()
+
+    # CPU time of counting every request cold (recorded requests are plain dicts,
+    # so no per-message cache applies; tool schema caches are cleared)
+    cpu_times = []
+    for _ in range(repeat):
+        started = time.process_time()
+        for messages, tools, _ in requests:
+            llm._tool_token_cache.clear()
+            count_request(llm, messages, tools)
+        cpu_times.append(time.process_time() - started)
+    cpu = min(cpu_times)
+
+    return {
+        "mode": mode,
+        "requests": len(requests),
+        "cpu_seconds": round(cpu, 6),
+        "cpu_ms_per_request": round(cpu / len(requests) * 1000, 4),
+        "error": error,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("cassettes", nargs="+", help="Cassette files of recorded flows")
+    parser.add_argument(
+        "--repeat", type=int, default=10, help="Timing passes per mode (best is kept)"
+    )
+    parser.add_argument(
+        "--config", default="default", help="LLM config whose model/tokenizer is used"
+    )
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    missing = [path for path in args.cassettes if not Path(path).is_file()]
+    if missing:
+        parser.error(f"Cassette not found: {', '.join(missing)}")
+    requests = load_requests(args.cassettes)
+    if not requests:
+        parser.error("No recorded request reports usage.prompt_tokens")
+
+    llm = LLM(args.config)
+    results = [
+        run_mode(llm, mode, requests, args.repeat) for mode in TOKEN_COUNTING_MODES
+    ]
+    for result in results:
+        logger.info(f"[{result['mode']}] {result}")
+
+    print(f"\n{len(requests)} requests from {len(args.cassettes)} cassette(s)")
+    print(
+        f"{'mode':<10} {'cpu ms/req':>11} {'bias':>8} {'p50 err':>8} {'p95 err':>8} {'max err':>8}"
+    )
+    for result in results:
+        error = result["error"]
+        print(
+            f"{result['mode']:<10} {result['cpu_ms_per_request']:>11.4f} "
+            f"{error['bias']:>8.2%} {error['p50_abs_error']:>8.2%} "
+            f"{error['p95_abs_error']:>8.2%} {error['max_abs_error']:>8.2%}"
+        )
+    exact, estimate = results
+    if estimate["cpu_seconds"]:
+        print(
+            f"\nestimate is {exact['cpu_seconds'] / estimate['cpu_seconds']:.1f}x faster"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
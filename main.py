@@ -1,6 +1,7 @@
 import asyncio
 
 from app.agent.manus import Manus
+from app.http_pool import close_http_pool
 from app.logger import logger
 
 
@@ -17,6 +18,8 @@ async def main():
         logger.info("Request processing completed.")
     except KeyboardInterrupt:
         logger.warning("Operation interrupted.")
+    finally:
+        await close_http_pool()
 
 
 if __name__ == "__main__":
@@ -4,6 +4,7 @@ import time
 from app.agent.manus import Manus
 from app.flow.base import FlowType
 from app.flow.flow_factory import FlowFactory
+from app.http_pool import close_http_pool
 from app.logger import logger
 
 
@@ -44,6 +45,8 @@ async def run_flow():
         logger.info("Operation cancelled by user.")
     except Exception as e:
         logger.error(f"Error: {str(e)}")
+    finally:
+        await close_http_pool()
 
 
 if __name__ == "__main__":